@@ -48,6 +48,24 @@ def read_as_np(filename):
     return gdal_ds.ReadAsArray()
 
 
+def nonzero_ratio(filename, block_rows=1024):
+    """
+    Ratio of non-zero pixels in the first band of a raster. The raster is read by blocks of rows, so that the memory
+    footprint stays bounded whatever the image size
+    :param filename: raster filename
+    :param block_rows: number of rows read at once
+    :return: the ratio of non-zero pixels, in [0, 1]
+    """
+    gdal_ds = gdal_open(filename)
+    band = gdal_ds.GetRasterBand(1)
+    nonzero = 0
+    for y in range(0, gdal_ds.RasterYSize, block_rows):
+        rows = min(block_rows, gdal_ds.RasterYSize - y)
+        nonzero += np.count_nonzero(band.ReadAsArray(0, y, gdal_ds.RasterXSize, rows))
+
+    return nonzero / (gdal_ds.RasterXSize * gdal_ds.RasterYSize)
+
+
 def set_gdal_cachemax(gdal_cachemax):
     """
     Set GDAL_CACHEMAX
@@ -105,6 +105,11 @@ def join(*pthslist):
     return str(pathlib.PurePath(*pthslist))
 
 
+def read_lines(filename):
+    """ Returns the non-empty lines of a text file, stripped """
+    return [line.strip() for line in pathlib.Path(filename).read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
 def list_files_in_zip(filename, endswith=None):
     """ List files in zip archive
     :param filename: path of the zip
@@ -165,6 +170,37 @@ def get_env_var(var):
     return value
 
 
+def init_worker(n_threads):
+    """
+    Initialize a worker process of a process pool
+    :param n_threads: number of threads that the worker can use
+    """
+    # Avoid the oversubscription of the CPUs by the OTB applications and GDAL of all workers
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(n_threads)
+    os.environ["OMP_NUM_THREADS"] = str(n_threads)
+    os.environ["GDAL_NUM_THREADS"] = str(n_threads)
+
+
+def set_runtime_env(gdal_cache_mb=None, tf_intra=None, tf_inter=None):
+    """
+    Set the GDAL, PROJ and TensorFlow settings of the processing, without overriding the ones set in the environment
+    :param gdal_cache_mb: GDAL block cache size, in MB. Optional
+    :param tf_intra: number of threads used by TensorFlow inside an operation. Optional
+    :param tf_inter: number of threads used by TensorFlow to run independent operations. Optional
+    """
+    settings = {"GDAL_CACHEMAX": gdal_cache_mb,
+                "GDAL_NUM_THREADS": "ALL_CPUS",
+                "CPL_VSIL_CURL_CHUNK_SIZE": 16777216,
+                "VSI_CACHE": "TRUE",
+                "VSI_CACHE_SIZE": 268435456,
+                "PROJ_NETWORK": "OFF",  # no remote grids download when reprojecting
+                "TF_NUM_INTRAOP_THREADS": tf_intra,
+                "TF_NUM_INTEROP_THREADS": tf_inter}
+    for var, value in settings.items():
+        if value is not None:
+            os.environ.setdefault(var, str(value))
+
+
 def basic_logging_init():
     """ basic logging initialization """
     logging.basicConfig(
@@ -87,20 +87,30 @@ class Model(abc.ABC):
         # Get the model inputs
         model_inputs = self.get_inputs()
 
-        # Normalize the inputs
-        normalized_inputs = {key: normalize(key, input) for key, input in model_inputs.items()}
+        # Normalize the inputs, directly in the compute dtype of the layers (e.g. bfloat16 with mixed precision)
+        dtype = tf.as_dtype(tf.keras.mixed_precision.global_policy().compute_dtype)
+        normalized_inputs = {key: normalize(key, input, dtype=dtype) for key, input in model_inputs.items()}
 
         # Build the model
         outputs = self.get_outputs(normalized_inputs)
 
         # Add extra outputs
         extra_outputs = {}
-        for out_key, out_tensor in outputs.items():
+        extra_output_keys = constants.build_pad_names(outputs.keys())
+        for out_key, out_tensor in list(outputs.items()):
+            out_layer_name = out_tensor._keras_history.layer.name
+            if out_tensor.dtype != tf.float32:
+                # Mixed precision: the outputs, the loss and the unscaled reflectances are computed in float32
+                out_tensor = tf.keras.layers.Activation('linear', dtype='float32',
+                                                        name=out_layer_name + "_float32")(out_tensor)
+                outputs[out_key] = out_tensor
             for pad in constants.PADS:
-                extra_output_key = constants.padded_tensor_name(out_key, pad)
-                extra_output_name = constants.padded_tensor_name(out_tensor._keras_history.layer.name, pad)
+                extra_output_key = extra_output_keys[(out_key, pad)]
+                extra_output_name = constants.padded_tensor_name(out_layer_name, pad)
                 scale = constants.S2_UNSCALE_COEF
-                extra_output = tf.keras.layers.Cropping2D(cropping=pad, name=extra_output_name)(scale * out_tensor)
+                # float32 layer, else it would be autocast to float16 with mixed precision (reflectances up to 10000)
+                extra_output = tf.keras.layers.Cropping2D(cropping=pad, name=extra_output_name, dtype='float32')(
+                    scale * tf.cast(out_tensor, tf.float32))
                 extra_outputs[extra_output_key] = extra_output
         outputs.update(extra_outputs)
 
@@ -21,6 +21,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 """Classes and helpers for TFRecords"""
+import hashlib
 import logging
 import os
 import json
@@ -190,7 +191,22 @@ class TFRecords:
         normalized_outputs = {key: normalize(key, tensor) for key, tensor in outputs.items()}
         return inputs, normalized_outputs
 
-    def read(self, batch_size, target_keys, n_workers=1, drop_remainder=True, shuffle_buffer_size=None):
+    def cache_prefix(self, cache_dir, matching_files, target_keys, worker_index=0):
+        """
+        Prefix of the cache files of the parsed samples. It depends on the TFRecord files and on the target keys, so
+        that a cache is never reused for another dataset (even in a directory with the same name) or another model
+        :param cache_dir: cache directory
+        :param matching_files: TFRecord files
+        :param target_keys: list of keys of the targets
+        :param worker_index: index of the worker
+        :return: the cache files prefix
+        """
+        key = json.dumps([sorted(os.path.abspath(pth) for pth in matching_files), sorted(target_keys)])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, f"{system.basename(self.dirpath)}_{digest}_worker{worker_index}_parsed_cache")
+
+    def read(self, batch_size, target_keys, n_workers=1, drop_remainder=True, shuffle_buffer_size=None,
+             cache_dir=None, worker_index=0):
         """
         Read all tfrecord files matching with pattern and convert data to tensorflow dataset.
         :param batch_size: Size of tensorflow batch
@@ -200,20 +216,27 @@ class TFRecords:
         :param drop_remainder: whether the last batch should be dropped in the case it has fewer than
                                `batch_size` elements. True is advisable when training on multiworkers.
                                False is advisable when evaluating metrics so that all samples are used
-        :param shuffle_buffer_size: is None, shuffle is not used. Else, blocks of shuffle_buffer_size
-                                    elements are shuffled using uniform random.
+        :param shuffle_buffer_size: is None, shuffle is not used. Else, the order of the TFRecord files is shuffled,
+                                    and blocks of shuffle_buffer_size elements are shuffled using uniform random.
+        :param cache_dir: if None, cache is not used. Else, the parsed samples are cached in this directory during the
+                          first epoch, and the following epochs read them from the cache instead of parsing them again.
+                          The cache files are named after the TFRecord files and the target keys, but not after their
+                          content: the cache must be removed when the TFRecord files are modified
+        :param worker_index: index of the worker, used to give each worker its own cache files
         """
         options = tf.data.Options()
         if shuffle_buffer_size:
             options.experimental_deterministic = False  # disable order, increase speed
         options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.AUTO  # for multiworker
+        options.experimental_optimization.map_and_batch_fusion = True
+        options.experimental_optimization.parallel_batch = True
+        options.autotune.enabled = True
+        options.threading.private_threadpool_size = os.cpu_count()
+        options.threading.max_intra_op_parallelism = 1
         parse = partial(self.parse_tfrecord, features_types=self.output_types, target_keys=target_keys)
 
-        # TODO: to be investigated :
-        # 1/ num_parallel_reads useful ? I/O bottleneck of not ?
-        # 2/ num_parallel_calls=tf.data.experimental.AUTOTUNE useful ?
-        # 3/ shuffle or not shuffle ?
-        matching_files = glob.glob(self.tfrecords_pattern_path)
+        # Sorted, so that the files and their per-file caches (named after their index) match from one run to another
+        matching_files = sorted(glob.glob(self.tfrecords_pattern_path))
         logging.info('Searching TFRecords in %s...', self.tfrecords_pattern_path)
         logging.info('Number of matching TFRecords: %s', len(matching_files))
         matching_files = matching_files[:n_workers * (len(matching_files) // n_workers)]  # files multiple of workers
@@ -222,10 +245,32 @@ class TFRecords:
             raise Exception("At least one worker has no TFRecord file in {}. Please ensure that the number of TFRecord "
                             "files is greater or equal than the number of workers!".format(self.tfrecords_pattern_path))
         logging.info('Reducing number of records to : %s', nb_matching_files)
-        dataset = tf.data.TFRecordDataset(matching_files)  # , num_parallel_reads=2)  # interleaves reads from xxx files
+        cache_prefix = None
+        if cache_dir:
+            system.mkdir(cache_dir)
+            cache_prefix = self.cache_prefix(cache_dir, matching_files, target_keys, worker_index)
+
+        def _read_file(filename, index):
+            """
+            Parsed samples of one TFRecord file. When caching, each file has its own cache, so that the files order
+            can still be shuffled at every epoch
+            """
+            records = tf.data.TFRecordDataset(filename)
+            records = records.map(parse, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            records = records.map(self.normalize)
+            if cache_prefix:
+                records = records.cache(filename=tf.strings.join([cache_prefix, tf.strings.as_string(index)], "_"))
+            return records
+
+        # File-level shuffle (at every epoch), then interleaved reads of several files: records are mixed without a
+        # large buffer. The paths are not used as glob patterns, so that they can contain "[", "*" or "?"
+        files = tf.data.Dataset.from_tensor_slices((matching_files, list(range(nb_matching_files))))
+        if shuffle_buffer_size:
+            files = files.shuffle(nb_matching_files)
+        dataset = files.interleave(_read_file, cycle_length=tf.data.experimental.AUTOTUNE,
+                                   num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                                   deterministic=not shuffle_buffer_size)
         dataset = dataset.with_options(options)  # uses data as soon as it streams in, rather than in its original order
-        dataset = dataset.map(parse, num_parallel_calls=tf.data.experimental.AUTOTUNE)
-        dataset = dataset.map(self.normalize)
         if shuffle_buffer_size:
             dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
         dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
@@ -27,16 +27,7 @@ import logging
 import os
 import sys
 import time
-import tensorflow as tf
-from tensorflow import keras
 from decloud.core import system
-from decloud.models.model_factory import ModelFactory
-from decloud.models.tfrecord import TFRecords
-from decloud.models import metrics
-from decloud.models.callbacks import AdditionalValidationSets, ArchiveCheckpoint
-from decloud.core.summary import PreviewsCallback
-from decloud.models.utils import get_available_gpus
-from decloud.models.utils import _is_chief
 
 
 def main(args):
@@ -79,11 +70,27 @@ def main(args):
                         nargs='?',
                         choices=['mirrored', 'multiworker', 'singlecpu'],
                         help='tf.distribute strategy')
+    parser.add_argument('--communication', default='auto', choices=['auto', 'nccl', 'ring'],
+                        help="Collective communication implementation for the multiworker strategy. \"auto\" uses "
+                             "NCCL when GPUs are available, RING otherwise")
+    parser.add_argument('--cross_device_ops', default='default',
+                        choices=['default', 'hierarchical', 'nccl', 'one_device'],
+                        help="All-reduce implementation for the mirrored strategy. \"hierarchical\" or "
+                             "\"one_device\" can be used on machines where NCCL all-reduce crashes or is slow")
     parser.add_argument('--plot_model', dest='plot_model', action='store_true',
                         help="Whether we want to plot the model architecture. Requires additional libraries")
-    parser.add_argument('--shuffle_buffer_size', type=int, default=5000,
-                        help="Shuffle buffer size. To be decreased if low RAM is available.")
+    parser.add_argument('--shuffle_buffer_size', type=int, default=512,
+                        help="Shuffle buffer size. The TFRecord files are also shuffled, hence a small buffer is "
+                             "enough. To be decreased if low RAM is available.")
+    parser.add_argument('--cache_dir', help="Directory to cache the parsed training samples after the first epoch. "
+                                            "Default is off. The cache must be removed when the TFRecords change")
     parser.set_defaults(plot_model=False)
+    parser.add_argument('--mixed_precision', nargs='?', const='mixed_float16',
+                        choices=['mixed_float16', 'mixed_bfloat16'],
+                        help="Use float16 (default) or bfloat16 computations with float32 variables. Faster on GPUs "
+                             "with tensor cores. bfloat16 requires Ampere GPUs or newer. Default is off")
+    parser.add_argument('--steps_per_execution', type=int,
+                        help="Number of batches processed in each tf.function call. Default is 8 on GPU, 1 on CPU")
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -91,6 +98,18 @@ def main(args):
 
     params = parser.parse_args(args)
 
+    # TensorFlow is imported once the arguments are parsed, so that the help is displayed quickly
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from tensorflow import keras
+    from decloud.models.model_factory import ModelFactory
+    from decloud.models.tfrecord import TFRecords
+    from decloud.models import metrics
+    from decloud.models.callbacks import AdditionalValidationSets, ArchiveCheckpoint
+    from decloud.core.summary import PreviewsCallback
+    from decloud.models.utils import get_available_gpus
+    from decloud.models.utils import _is_chief
+
     # Logging
     system.basic_logging_init()
 
@@ -104,31 +123,51 @@ def main(args):
         logging.error("Please provide a path for the output SavedModel.")
         system.terminate()
 
+    # Mixed precision policy, to be set before the model is built
+    if params.mixed_precision:
+        logging.info("Using mixed precision policy %s", params.mixed_precision)
+        tf.keras.mixed_precision.set_global_policy(params.mixed_precision)
+
+    # Number of local GPUs
+    n_gpus = len(get_available_gpus())
+
+    # Index of this worker (only multiworker runs have several workers)
+    worker_index = 0
+
     # Strategy
     if params.strategy == "multiworker":
         # Srategy cf http://www.idris.fr/jean-zay/gpu/jean-zay-gpu-tf-multi.html
         # build multi-worker environment from Slurm variables
         cluster_resolver = tf.distribute.cluster_resolver.SlurmClusterResolver(port_base=13565)  # On Jean-Zay cluster
-        # use NCCL communication protocol
-        implementation = tf.distribute.experimental.CommunicationImplementation.NCCL
+        # use NCCL communication protocol on GPUs, RING on CPUs (NCCL can hang without GPU)
+        communication = params.communication
+        if communication == "auto":
+            communication = "nccl" if n_gpus > 0 else "ring"
+        implementation = {"nccl": tf.distribute.experimental.CommunicationImplementation.NCCL,
+                          "ring": tf.distribute.experimental.CommunicationImplementation.RING}[communication]
+        logging.info("Using %s communication implementation", communication.upper())
         communication_options = tf.distribute.experimental.CommunicationOptions(implementation=implementation)
         # declare distribution strategy
         strategy = tf.distribute.MultiWorkerMirroredStrategy(cluster_resolver=cluster_resolver,
                                                              communication_options=communication_options)
-        # get total number of workers
+        # get total number of workers, and the index of this one
         n_workers = int(os.environ['SLURM_NTASKS'])
+        worker_index = cluster_resolver.task_id
     elif params.strategy == "mirrored":
-        strategy = tf.distribute.MirroredStrategy()
-        # Get number of GPUs
-        n_workers = len(get_available_gpus())
+        cross_device_ops = {"default": None,
+                            "hierarchical": tf.distribute.HierarchicalCopyAllReduce,
+                            "nccl": tf.distribute.NcclAllReduce,
+                            "one_device": tf.distribute.ReductionToOneDevice}[params.cross_device_ops]
+        strategy = tf.distribute.MirroredStrategy(cross_device_ops=cross_device_ops() if cross_device_ops else None)
+        n_workers = n_gpus
     elif params.strategy == "singlecpu":
         strategy = tf.distribute.OneDeviceStrategy(device="/cpu:0")
         n_workers = 0
     else:
-        logging.error("Please provide a supported tf.distribute strategy.")
-        system.terminate()
+        raise Exception("Please provide a supported tf.distribute strategy (got \"{}\")".format(params.strategy))
 
-    # CPU or GPU
+    # CPU or GPU (multiworker runs have workers even without GPU, and the singlecpu strategy ignores the GPUs)
+    use_gpu = n_gpus > 0 and params.strategy != "singlecpu"
     if n_workers == 0:
         logging.info('No GPU found, using CPU')
         n_workers = 1
@@ -158,6 +197,9 @@ def main(args):
     batch_size_valid = params.batch_size_valid * n_workers
     learning_rate = params.learning_rate * n_workers
 
+    # Running several steps per tf.function call amortizes the per-step dispatch overhead
+    steps_per_execution = params.steps_per_execution or (8 if use_gpu else 1)
+
     logging.info("Learning rate was scaled to %s, effective batch size is %s (%s workers)",
                  learning_rate, batch_size_train, n_workers)
 
@@ -172,11 +214,20 @@ def main(args):
     tf_ds_train = tfrecord_train.read(batch_size=batch_size_train,
                                       target_keys=model.model_output_keys,
                                       n_workers=n_workers,
-                                      shuffle_buffer_size=params.shuffle_buffer_size) if tfrecord_train else None
+                                      shuffle_buffer_size=params.shuffle_buffer_size,
+                                      cache_dir=params.cache_dir,
+                                      worker_index=worker_index) if tfrecord_train else None
     tf_ds_valid = [tfrecord.read(batch_size=batch_size_valid,
                                  target_keys=model.model_output_keys,
                                  n_workers=n_workers) for tfrecord in tfrecord_valid_array]
 
+    # Distribute the training dataset explicitly, so that each replica prefetches its batches onto its own device
+    # (the host to device copy then overlaps with the computation of the previous step)
+    if tf_ds_train and use_gpu:
+        input_options = tf.distribute.InputOptions(experimental_fetch_to_device=True,
+                                                   experimental_per_replica_buffer_size=2)
+        tf_ds_train = strategy.experimental_distribute_dataset(tf_ds_train, options=input_options)
+
     with strategy.scope():
         # Creating the Keras network corresponding to the model
         model.create_network()
@@ -188,8 +239,13 @@ def main(args):
 
         # Creating the model or loading it from checkpoints
         logging.info("Loading model \"%s\"", params.model)
+        optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+        if params.mixed_precision == 'mixed_float16':
+            # Scales the loss to prevent the underflow of float16 gradients
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
         model.compile(
-            optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+            optimizer=optimizer,
+            steps_per_execution=steps_per_execution,
             loss=model.get_loss(),
             metrics={
                 out_key: metric()
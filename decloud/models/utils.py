@@ -23,17 +23,18 @@ DEALINGS IN THE SOFTWARE.
 """
 Helpers for model training
 """
-from tensorflow.python.client import device_lib
+import functools
+import tensorflow as tf
 
 
 # ------------------------------------------------ GPU Helper --------------------------------------------------------
+@functools.lru_cache(maxsize=1)
 def get_available_gpus():
     """
-    Returns a list of the identifiers of all visible GPUs.
-    Source: https://stackoverflow.com/questions/38559755/how-to-get-current-available-gpus-in-tensorflow
+    Returns a tuple of the identifiers of all visible GPUs.
+    The physical devices are listed without initializing them, and the result is computed only once.
     """
-    local_device_protos = device_lib.list_local_devices()
-    return [x.name for x in local_device_protos if x.device_type == 'GPU']
+    return tuple(device.name for device in tf.config.list_physical_devices('GPU'))
 
 
 # ----------------------------------------------- Saving Helper -------------------------------------------------------
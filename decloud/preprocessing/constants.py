@@ -21,6 +21,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 """Constants"""
+import os
 import re
 
 
@@ -54,6 +55,71 @@ S1_NORMALIZATION_BM_EXPR = "im1b1==0?0:im1b1<exp({mindb})?1:im1b1>exp({maxdb})?{
                            ")".format(mindb=MINDB, maxdb=MAXDB, UINT16=UINT16, eps=EPSILON)
 
 
+def streaming_options(tilesize):
+    """
+    OTB streaming options for the prepared rasters: strips of N rows of tiles, with N given by the
+    DECLOUD_STREAMING_TILES environment variable (4 by default). Larger strips mean fewer and larger writes, at the
+    cost of more memory.
+    :param tilesize: size of the GeoTIFF tiles
+    :return: OTB extended filename part
+    """
+    nb_tiles = int(os.environ.get("DECLOUD_STREAMING_TILES", "4"))
+    return f"&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={nb_tiles * tilesize}"
+
+
+# GDAL compression options (OTB extended filename) for the prepared rasters, selected with the DECLOUD_COMPRESS
+# environment variable. ZSTD is faster to write and to read than DEFLATE. The rasters are integer images, for which
+# the horizontal predictor (PREDICTOR=2) shrinks the files.
+COMPRESSION_OPTIONS = {
+    "zstd": "&gdal:co:COMPRESS=ZSTD&gdal:co:ZSTD_LEVEL=1&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS",
+    "deflate": "&gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS"
+}
+
+
+def gdal_has_zstd():
+    """
+    :return: True if the GeoTIFF driver of GDAL can write ZSTD compressed images
+    """
+    # Imported here to keep this module free of the GDAL dependency
+    from osgeo import gdal  # pylint: disable=import-outside-toplevel
+    creation_options = gdal.GetDriverByName('GTiff').GetMetadataItem('DMD_CREATIONOPTIONLIST')
+    return 'ZSTD' in (creation_options or "")
+
+
+def compression_options():
+    """
+    GDAL compression options for the prepared rasters, depending on the DECLOUD_COMPRESS environment variable.
+    When it is not set, ZSTD is used if GDAL supports it, else DEFLATE.
+    :return: OTB extended filename part
+    """
+    compress = os.environ.get("DECLOUD_COMPRESS")
+    if compress is None:
+        compress = "zstd" if gdal_has_zstd() else "deflate"
+    compress = compress.lower()
+    if compress not in COMPRESSION_OPTIONS:
+        raise ValueError(f"DECLOUD_COMPRESS must be one of {list(COMPRESSION_OPTIONS)} (got \"{compress}\")")
+    return COMPRESSION_OPTIONS[compress]
+
+
+def s1_normalize_vvvh(vv_fn, vh_fn):
+    """
+    Create the OTB BandMathX application performing the Sentinel-1 channels normalization (see
+    S1_NORMALIZATION_BM_EXPR) and their stacking, in a single pass over the VV and VH images.
+    The application is not executed, so that its output parameter can be set before.
+    :param vv_fn: input Sentinel-1 VV channel filename
+    :param vh_fn: input Sentinel-1 VH channel filename
+    :return: the BandMathX application, with 2 output channels (VV, VH)
+    """
+    # Imported here to keep this module free of the OTB dependency
+    import otbApplication  # pylint: disable=import-outside-toplevel
+    bmx = otbApplication.Registry.CreateApplication("BandMathX")
+    bmx.SetParameterStringList("il", [vv_fn, vh_fn])
+    bmx.SetParameterString("exp", "{};{}".format(S1_NORMALIZATION_BM_EXPR,
+                                                 S1_NORMALIZATION_BM_EXPR.replace("im1b1", "im2b1")))
+    bmx.SetParameterOutputImagePixelType("out", otbApplication.ImagePixelType_uint16)
+    return bmx
+
+
 def padded_tensor_name(tensor_name, pad):
     """
     A name for the padded tensor
@@ -61,4 +127,13 @@ def padded_tensor_name(tensor_name, pad):
     :param pad: pad value
     :return: name
     """
-    return "{}_pad{}".format(tensor_name, pad)
+    return f"{tensor_name}_pad{pad}"
+
+
+def build_pad_names(tensor_names):
+    """
+    Names of the padded tensors, for all pad values
+    :param tensor_names: tensor names
+    :return: dict of names, with keys=(tensor name, pad value)
+    """
+    return {(tensor_name, pad): padded_tensor_name(tensor_name, pad) for tensor_name in tensor_names for pad in PADS}
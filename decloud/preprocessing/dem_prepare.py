@@ -24,12 +24,16 @@ DEALINGS IN THE SOFTWARE.
 """Prepare the DEM image"""
 import argparse
 import logging
+import os
 import elevation
-from osgeo import gdal
+import elevation.util
+from osgeo import gdal, osr
 import decloud.preprocessing.constants as constants
-import otbApplication as otb
 from decloud.core import system
 
+# Default maximum number of DEM tiles to download, as the max_download_tiles default of elevation.seed()
+MAX_DOWNLOAD_TILES = 9
+
 
 def clean(params):
     """
@@ -55,15 +59,55 @@ def get_bounds_wgs84(params):
     Return the bounding box in WGS84 CRS
     """
 
-    option_clip = gdal.WarpOptions(format="Mem", dstSRS='EPSG:4326')
-
-    raster_reproj = gdal.Warp("", params.reference, options=option_clip)
-
-    bounds = get_bounds(raster_reproj)
+    # Only the bounding box is reprojected (no need to warp the whole raster)
+    raster = gdal.Open(params.reference)
+    src_srs = osr.SpatialReference(wkt=raster.GetProjection())
+    dst_srs = osr.SpatialReference()
+    dst_srs.ImportFromEPSG(4326)
+    src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src_srs, dst_srs)
+
+    # The bounds edges are densified to account for the curvature of the reprojected edges
+    bounds = list(transform.TransformBounds(*get_bounds(raster), 21))
     logging.info("Bounds: %s", bounds)
     return elevation.datasource.build_bounds(bounds=bounds, margin=params.margin)
 
 
+def seed(params, bounds):
+    """
+    Download the DEM tiles covering the bounds, like elevation.seed() but with parallel downloads
+    :param params: parameters
+    :param bounds: bounds in WGS84 CRS
+    :return: the datasource root directory
+    """
+    product = elevation.DEFAULT_PRODUCT
+    datasource_root, spec = elevation.datasource.ensure_setup(params.tmp, product)
+    tiles_names = list(spec['tile_names'](*bounds))
+    # Same guard as elevation.seed(), against the unbounded downloads of a wrong reference footprint
+    if len(tiles_names) > params.max_download_tiles:
+        raise RuntimeError("Too many DEM tiles to download: {} (maximum is {}). Please check the reference image "
+                           "footprint".format(len(tiles_names), params.max_download_tiles))
+    logging.info("Downloading %s tiles", len(tiles_names))
+
+    # A single make call for all the tiles, run with parallel jobs: tiles already in the cache are skipped by
+    # elevation, and only one make process works in the datasource directory
+    makeflags = os.environ.get("MAKEFLAGS")
+    os.environ["MAKEFLAGS"] = "-j{}".format(params.download_jobs)
+    try:
+        elevation.datasource.ensure_tiles(datasource_root, tiles_names)
+    finally:
+        if makeflags is None:
+            del os.environ["MAKEFLAGS"]
+        else:
+            os.environ["MAKEFLAGS"] = makeflags
+
+    # Build the VRT of the tiles
+    elevation.util.check_call_make(datasource_root, targets=['all'])
+
+    return datasource_root
+
+
 def download_dem(params, output):
     """
     Download the DEM
@@ -72,9 +116,13 @@ def download_dem(params, output):
     """
     bounds = get_bounds_wgs84(params)
     logging.info("Seed")
-    datasource_root = elevation.seed(cache_dir=params.tmp, product=elevation.DEFAULT_PRODUCT, bounds=bounds)
+    datasource_root = seed(params, bounds)
     logging.info("Clip")
-    elevation.datasource.do_clip(path=datasource_root, bounds=bounds, output=output)
+    # The seeded tiles are gathered in a VRT named after the product, which is clipped directly with GDAL
+    vrt = os.path.join(datasource_root, "{}.vrt".format(elevation.DEFAULT_PRODUCT))
+    left, bottom, right, top = bounds
+    gdal.Translate(output, vrt, projWin=[left, top, right, bottom], format="GTiff",
+                   creationOptions=["COMPRESS=DEFLATE", "PREDICTOR=2", "NUM_THREADS=ALL_CPUS", "TILED=YES"])
 
 
 def superimpose(params, tmp_filename):
@@ -84,11 +132,12 @@ def superimpose(params, tmp_filename):
     :param tmp_filename: filename
     """
 
+    import otbApplication as otb  # pylint: disable=import-outside-toplevel
     logging.info("Superimpose")
 
     out_fn = params.output
-    out_fn += "?&gdal:co:COMPRESS=DEFLATE"
-    out_fn += "&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}".format(4 * params.tilesize)
+    out_fn += "?&gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS"
+    out_fn += constants.streaming_options(params.tilesize)
     out_fn += "&gdal:co:TILED=YES&gdal:co:BLOCKXSIZE={}&gdal:co:BLOCKYSIZE={}".format(params.tilesize, params.tilesize)
 
     app = otb.Registry.CreateApplication("Superimpose")
@@ -109,7 +158,11 @@ def main(args):
     parser.add_argument("--tmp", required=True, help="Temporary directory to download/pre-process the files")
     parser.add_argument("--tilesize", type=int, default=constants.PATCHSIZE_REF)
     parser.add_argument("--margin", type=str, default="0")
-    parser.add_argument("--clean", action='store_false')
+    parser.add_argument("--clean", action='store_true',
+                        help="Remove the cached DEM tiles before downloading. Default is to reuse them")
+    parser.add_argument("--download_jobs", type=int, default=8, help="Number of DEM tiles downloaded in parallel")
+    parser.add_argument("--max_download_tiles", type=int, default=MAX_DOWNLOAD_TILES,
+                        help="Maximum number of DEM tiles to download")
     params = parser.parse_args(args)
 
     elevation.CACHE_DIR = params.tmp
@@ -23,6 +23,7 @@ DEALINGS IN THE SOFTWARE.
 """
 """Create ROI binary mask rasters"""
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
 import logging
@@ -33,6 +34,70 @@ from decloud.core import system
 from decloud.preprocessing import constants
 
 
+def process_tile(tile, tiles, params, props):
+    """
+    Create the ROI rasters of one tile
+    :param tile: tile name
+    :param tiles: tiles descriptor
+    :param params: parameters
+    :param props: numpy array of the proportions of samples for each dataset (sum is 1)
+    """
+    fg_val = 1
+    nb_datasets = len(props)
+    rng = np.random.default_rng()  # seeded from fresh OS entropy, also in forked workers
+
+    # Get an arbitrary raster corresponding to the extent of this tile. We take the first CLM_stats of S2_
+    matches = [os.path.join(tiles['S2_ROOT_DIR'], tile, x) for x in
+               os.listdir(os.path.join(tiles['S2_ROOT_DIR'], tile)) if
+               os.path.isdir(os.path.join(tiles['S2_ROOT_DIR'], tile, x))]
+    # Throw an error if no Sentinel-2 tile has been found
+    if len(matches) == 0:
+        raise FileNotFoundError("No Sentinel-2 tile found in {}. Please check the tiles descriptor ({})".format(
+            tiles['S2_ROOT_DIR'], params.tiles))
+    first_s2_dir = matches[0]
+    candidates = [os.path.join(first_s2_dir, x) for x in os.listdir(first_s2_dir) if x.endswith('CLM_R1_stats.tif')]
+    # Throw an error if no cloud coverage stats has been found
+    if len(candidates) == 0:
+        raise FileNotFoundError("No Sentinel-2 auxiliary file for cloud coverage statistics found in {}".format(
+            first_s2_dir))
+    first_clm_stats = candidates[0]
+
+    # Fill this raster with zeros
+    # This raster pixel spacing is 10m * constants.PATCHSIZE_REF (i.e. likely 640m)
+    initialized_raster = pyotb.BandMath(il=first_clm_stats, exp="1==1 ? 0 : 0")
+
+    # Create a undersampled raster where one pixel is equivalent to one patch
+    scale = constants.PATCHSIZE_REF / params.patchsize
+    undersampled = pyotb.RigidTransformResample({"in": initialized_raster, "interpolator": "nn",
+                                                 "transform.type.id.scalex": scale,
+                                                 "transform.type.id.scaley": scale})
+
+    rois_arrays = [np.asarray(pyotb.Rasterization({'in': roi, 'im': undersampled,
+                                                   'mode.binary.foreground': fg_val})) if roi else None for roi
+                   in params.rois]
+
+    # Random selection of zones for the specified datasets, fills the array with 0 for the 1st dataset,
+    # 1 for 2nd dataset etc...
+    random_patches = rng.choice(nb_datasets, p=props, size=undersampled.shape)
+
+    # Using a specific ROI for each dataset
+    # Patches under a polygon are selected, and this prevails on the random selection.
+    # Warning: if ROI of different datasets overlap together, resulting datasets can have a non-null intersection.
+    for dataset_id, rois_array in enumerate(rois_arrays):
+        if rois_array:
+            random_patches = np.where(rois_array == fg_val, dataset_id, random_patches)
+
+    # One channel per dataset, resampled to the needed spacing in a single pipeline
+    patches_list = [np.add(undersampled, (random_patches == dataset_id).astype(int))  # these are pyotb objects
+                    for dataset_id in range(nb_datasets)]
+    final_rois = pyotb.Superimpose(inm=pyotb.ConcatenateImages(il=patches_list), inr=initialized_raster,
+                                   interpolator='nn')
+
+    # Write one raster per dataset, straight from the channels of the resampled image
+    for dataset_id, dataset in enumerate(params.datasets):
+        final_rois[:, :, dataset_id].write(os.path.join(params.output_dir, '{}_{}.tif'.format(tile, dataset)))
+
+
 def main(args):
     parser = argparse.ArgumentParser(description="Creating TFRecords")
     parser.add_argument("--tiles", "-t", required=True, help="Path to a .json file used to instantiate the TilesLoader")
@@ -47,6 +112,7 @@ def main(args):
     parser.add_argument('--rois', nargs='+', default=[],
                         help="Paths to vector files specifying ROIs "
                              "(one path for each dataset: use empty paths for datasets with not ROI)")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of tiles processed in parallel")
 
     params = parser.parse_args(args)
 
@@ -64,59 +130,24 @@ def main(args):
     assert params.patchsize % constants.PATCHSIZE_REF == 0
 
     # normalize the number samples to percentages whose sum makes 100%
-    props = [x / sum(params.props) for x in params.props]
-
-    for tile in tiles['TILES']:
-        # Get an arbitrary raster corresponding to the extent of this tile. We take the first CLM_stats of S2_
-        matches = [os.path.join(tiles['S2_ROOT_DIR'], tile, x) for x in
-                   os.listdir(os.path.join(tiles['S2_ROOT_DIR'], tile)) if
-                   os.path.isdir(os.path.join(tiles['S2_ROOT_DIR'], tile, x))]
-        # Throw an error if no Sentinel-2 tile has been found
-        if len(matches) == 0:
-            logging.fatal("No Sentinel-2 tile found in %s. Please check the tiles descriptor (%s)",
-                          tiles['S2_ROOT_DIR'], params.tiles)
-            system.terminate()
-        first_s2_dir = matches[0]
-        candidates = [os.path.join(first_s2_dir, x) for x in os.listdir(first_s2_dir) if x.endswith('CLM_R1_stats.tif')]
-        # Throw an error if no cloud coverage stats has been found
-        if len(candidates) == 0:
-            logging.fatal("No Sentinel-2 auxiliary file for cloud coverage statistics found in %s", first_s2_dir)
-            system.terminate()
-        first_clm_stats = candidates[0]
-
-        # Fill this raster with zeros
-        # This raster pixel spacing is 10m * constants.PATCHSIZE_REF (i.e. likely 640m)
-        initialized_raster = pyotb.BandMath(il=first_clm_stats, exp="1==1 ? 0 : 0")
-
-        # Create a undersampled raster where one pixel is equivalent to one patch
-        scale = constants.PATCHSIZE_REF / params.patchsize
-        undersampled = pyotb.RigidTransformResample({"in": initialized_raster, "interpolator": "nn",
-                                                     "transform.type.id.scalex": scale,
-                                                     "transform.type.id.scaley": scale})
-
-        fg_val = 1
-        rois_arrays = [np.asarray(pyotb.Rasterization({'in': roi, 'im': undersampled,
-                                                       'mode.binary.foreground': fg_val})) if roi else None for roi
-                       in params.rois]
-
-        # Random selection of zones for the specified datasets, fills the array with 0 for the 1st dataset,
-        # 1 for 2nd dataset etc...
-        random_patches = np.random.choice(np.arange(0, len(params.datasets)), p=props,
-                                          size=undersampled.shape)
-
-        # Using a specific ROI for each dataset
-        # Patches under a polygon are selected, and this prevails on the random selection.
-        # Warning: if ROI of different datasets overlap together, resulting datasets can have a non-null intersection.
-        for dataset_id, rois_array in enumerate(rois_arrays):
-            if rois_array:
-                random_patches = np.where(rois_array == fg_val, dataset_id, random_patches)
-
-        for dataset_id, dataset in enumerate(params.datasets):
-            patches = np.add(undersampled, (random_patches == dataset_id).astype(int))  # this is a pyotb object
-
-            # Resample to the needed spacing
-            final_roi = pyotb.Superimpose(inm=patches, inr=initialized_raster, interpolator='nn')
-            final_roi.write(os.path.join(params.output_dir, '{}_{}.tif'.format(tile, dataset)))
+    props = np.asarray(params.props) / sum(params.props)
+
+    # Process the tiles. The workers raise their errors, and the program is ended here
+    try:
+        if params.jobs > 1:
+            n_jobs = min(params.jobs, len(tiles['TILES']))
+            n_threads = max(1, os.cpu_count() // n_jobs)
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=system.init_worker,
+                                     initargs=(n_threads,)) as executor:
+                futures = [executor.submit(process_tile, tile, tiles, params, props) for tile in tiles['TILES']]
+                for future in futures:
+                    future.result()
+        else:
+            for tile in tiles['TILES']:
+                process_tile(tile, tiles, params, props)
+    except FileNotFoundError as err:
+        logging.fatal(err)
+        system.terminate()
 
 
 if __name__ == "__main__":
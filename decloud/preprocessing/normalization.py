@@ -21,47 +21,66 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 """Sentinel images and DEM normalization """
+import numpy as np
 import tensorflow as tf
 import decloud.preprocessing.constants as constants
 
+# Scale factors, built once. They are numpy scalars rather than tf.constant, since creating tensors at import time
+# would initialize the TensorFlow runtime before the tf.distribute strategy is set up
+_S1_SCALE = np.float32(constants.S1_SCALE_COEF)
+_S2_SCALE = np.float32(constants.S2_SCALE_COEF)
+_S2_UNSCALE = np.float32(constants.S2_UNSCALE_COEF)
+_DEM_SCALE = np.float32(constants.DEM_SCALE_COEF)
+
+
+def _scale(input_image, scale, dtype):
+    """
+    Cast an image and multiply it by a scale factor
+    :param input_image: input image
+    :param scale: scale factor (float32)
+    :param dtype: output dtype
+    :return: scaled image
+    """
+    if dtype in (tf.float16, tf.bfloat16):
+        # The raw values would lose precision in half precision, hence they are scaled in float32 first
+        return tf.cast(tf.cast(input_image, tf.float32) * scale, dtype)
+    return tf.cast(input_image, dtype) * tf.cast(scale, dtype)  # the cast of the scale is folded in the graph
+
 
 def normalize_s1(input_image, dtype=tf.float32):
     """ Normalize Sentinel-1 image """
-    return constants.S1_SCALE_COEF * tf.cast(input_image, dtype)
+    return _scale(input_image, _S1_SCALE, dtype)
 
 
 def normalize_s2(input_image, dtype=tf.float32):
     """ Normalize Sentinel-2 image """
-    return constants.S2_SCALE_COEF * tf.cast(input_image, dtype)
+    return _scale(input_image, _S2_SCALE, dtype)
 
 
 def normalize_dem(input_image, dtype=tf.float32):
     """ Normalize DEM """
-    return constants.DEM_SCALE_COEF * tf.cast(input_image, dtype)
+    return _scale(input_image, _DEM_SCALE, dtype)
+
+
+# Normalization functions, from the keys prefixes ("s1", "s2") or the full key (DEM)
+_NORMALIZE_FUNCS = {"s1": normalize_s1, "s2": normalize_s2, constants.DEM_KEY: normalize_dem}
 
 
-def normalize(key, placeholder):
+def normalize(key, placeholder, dtype=tf.float32):
     """
     Normalize an input placeholder, knowing its key
     :param key: placeholder key
     :param placeholder: placeholder
+    :param dtype: dtype of the normalized placeholder, e.g. tf.bfloat16 to halve the memory traffic
     :return: normalized placeholder
     """
-    func = None
-    if key.startswith("s1"):
-        func = normalize_s1
-    elif key.startswith("s2"):
-        func = normalize_s2
-    elif key == constants.DEM_KEY:
-        func = normalize_dem
-    else:
-        # Do not normalize
-        pass
+    func = _NORMALIZE_FUNCS.get(key[:2]) or _NORMALIZE_FUNCS.get(key)
     if func is not None:
-        return func(placeholder)
+        return func(placeholder, dtype=dtype)
+    # Do not normalize
     return placeholder
 
 
 def denormalize_s2(input_image, dtype=tf.float32):
     """ De-normalize Sentinel-2 image """
-    return constants.S2_UNSCALE_COEF * tf.cast(input_image, dtype)
+    return _scale(input_image, _S2_UNSCALE, dtype)
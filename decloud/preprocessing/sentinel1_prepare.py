@@ -25,27 +25,18 @@ DEALINGS IN THE SOFTWARE.
 import os
 import logging
 import argparse
-import otbApplication
 from decloud.core import system, tile_io
 import decloud.preprocessing.constants as constants
 
 system.basic_logging_init()
 
 
-def _bm(input_fn):
-    """ BandMath for SAR normalization """
-    bm = otbApplication.Registry.CreateApplication("BandMath")
-    bm.SetParameterStringList("il", [input_fn])
-    bm.SetParameterString("exp", constants.S1_NORMALIZATION_BM_EXPR)
-    bm.SetParameterOutputImagePixelType("out", otbApplication.ImagePixelType_uint16)
-    bm.Execute()
-    return bm
-
-
 # Input filenames
-def _check_file_exists(fn):
-    if not system.file_exists(fn):
+def _check_files_exist(*fns):
+    missing = [fn for fn in fns if not system.file_exists(fn)]
+    for fn in missing:
         logging.fatal("File %s not found!", fn)
+    if missing:
         system.terminate()
 
 
@@ -66,32 +57,25 @@ def main(args):
 
     vh_fn = params.input_s1_vh
     vv_fn = vh_fn.replace("_vh_", "_vv_")
-    _check_file_exists(vh_fn)
-    _check_file_exists(vv_fn)
+    _check_files_exist(vh_fn, vv_fn)
 
     # Output filename
     out_fn = vh_fn
     out_fn = system.basename(out_fn)
     out_fn = out_fn.replace("_vh_", "_vvvh_")
     out_fn = "{}_{}".format(out_fn[:out_fn.rfind(".")], constants.SUFFIX_S1)
-    out_fn += ".tif?&gdal:co:COMPRESS=DEFLATE&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={" \
-              "}&gdal:co:TILED=YES&gdal:co:BLOCKXSIZE={}&gdal:co:BLOCKYSIZE={}".format(4 * constants.PATCHSIZE_REF,
-                                                                                       constants.PATCHSIZE_REF,
-                                                                                       constants.PATCHSIZE_REF)
+    out_fn += ".tif?" + constants.compression_options()
+    out_fn += constants.streaming_options(constants.PATCHSIZE_REF)
+    out_fn += "&gdal:co:TILED=YES&gdal:co:BLOCKXSIZE={ts}&gdal:co:BLOCKYSIZE={ts}".format(ts=constants.PATCHSIZE_REF)
 
     # Calibration + concatenation + tiling/compression
     out_fn = os.path.join(params.out_s1_dir, out_fn)
     if system.is_complete(out_fn):
         logging.info("File %s already exists. Skipping.", system.remove_ext_filename(out_fn))
     else:
-        bm_vv = _bm(vv_fn)
-        bm_vh = _bm(vh_fn)
-        conc = otbApplication.Registry.CreateApplication("ConcatenateImages")
-        conc.AddImageToParameterInputImageList("il", bm_vv.GetParameterOutputImage("out"))
-        conc.AddImageToParameterInputImageList("il", bm_vh.GetParameterOutputImage("out"))
-        conc.SetParameterString("out", out_fn)
-        conc.SetParameterOutputImagePixelType("out", otbApplication.ImagePixelType_uint16)
-        conc.ExecuteAndWriteOutput()
+        bmx = constants.s1_normalize_vvvh(vv_fn, vh_fn)
+        bmx.SetParameterString("out", out_fn)
+        bmx.ExecuteAndWriteOutput()
         system.declare_complete(out_fn)
 
     # Generate ancillary files
@@ -23,6 +23,7 @@ DEALINGS IN THE SOFTWARE.
 """
 """Pre-process one Sentinel-2 image"""
 import os
+import re
 import logging
 import argparse
 import otbApplication
@@ -31,6 +32,10 @@ import decloud.preprocessing.constants as constants
 
 system.basic_logging_init()
 
+# Classification of the product files: edge mask, cloud mask, 10m channels, 20m channels
+S2_FILES_PATTERN = re.compile(r"(?P<edg>EDG_R1)|(?P<clm>CLM_R1)|(?P<ch10m>FRE_B(?:2|3|4|8)\.)|"
+                              r"(?P<ch20m>FRE_B(?:5|6|7|8A|11|12)\.)")
+
 
 def fconc(il, suffix, tilesize, out_tile_dir, pixel_type=otbApplication.ImagePixelType_int16):
     """
@@ -45,8 +50,8 @@ def fconc(il, suffix, tilesize, out_tile_dir, pixel_type=otbApplication.ImagePix
     out_fn = system.basename(il[0])
     out_fn = out_fn[:out_fn.rfind("_")]
     out_fn = os.path.join(out_tile_dir, out_fn + "_" + suffix)
-    out_fn += ".tif?&gdal:co:COMPRESS=DEFLATE"
-    out_fn += "&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}".format(4 * tilesize)
+    out_fn += ".tif?" + constants.compression_options()
+    out_fn += constants.streaming_options(tilesize)
     out_fn += "&gdal:co:TILED=YES&gdal:co:BLOCKXSIZE={ts}&gdal:co:BLOCKYSIZE={ts}".format(ts=tilesize)
     if system.is_complete(out_fn):
         logging.info("File %s already existing. Skipping.", system.remove_ext_filename(out_fn))
@@ -80,7 +85,7 @@ def main(args):
     is_zip = params.in_image.lower().endswith(".zip")
     if is_zip:
         logging.info("Input type is a .zip archive")
-        files = system.list_files_in_zip(params.in_image)
+        files = system.list_files_in_zip(params.in_image, endswith=".tif")
     else:
         logging.info("Input type is a directory")
         files = system.get_files(params.in_image, ".tif")
@@ -91,16 +96,19 @@ def main(args):
     channels_20m = []
 
     for file in files:
+        match = S2_FILES_PATTERN.search(file)
+        if match is None:
+            continue
         if is_zip:
+            # Only the needed files are converted to GDAL virtual paths
             file = system.to_vsizip(params.in_image, file)
-
-        if "EDG_R1" in file:
+        if match.lastgroup == "edg":
             edg_mask = file
-        if "CLM_R1" in file:
+        elif match.lastgroup == "clm":
             cld_mask = file
-        if any(bn in file for bn in ["FRE_B2.", "FRE_B3.", "FRE_B4.", "FRE_B8."]):
+        elif match.lastgroup == "ch10m":
             channels_10m.append(file)
-        if any(bn in file for bn in ["FRE_B5.", "FRE_B6.", "FRE_B7.", "FRE_B8A.", "FRE_B11.", "FRE_B12."]):
+        else:
             channels_20m.append(file)
 
     channels_10m.sort()
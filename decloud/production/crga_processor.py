@@ -25,7 +25,9 @@ DEALINGS IN THE SOFTWARE.
 import argparse
 import os
 import sys
+import logging
 
+import numpy as np
 import decloud.preprocessing.constants as constants
 from decloud.core import system
 import pyotb
@@ -35,7 +37,7 @@ from decloud.production.inference import inference
 
 def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s2, dem, savedmodel,
                    output=None, output_20m=None, ts=256, pad=64,
-                   with_20m_bands=False, maxgap=144, with_intermediate=False):
+                   with_20m_bands=False, maxgap=144, with_intermediate=False, roi=None):
     """
     Apply CRGA model to input sources.
 
@@ -54,6 +56,8 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
     :param with_20m_bands: whether to compute the 20m bands. If True, the saved model must have been trained accordingly
     :param maxgap: max gap (in hours) between S1 and S2 images
     :param with_intermediate: whether to write/return intermediate results (T-1, T+1 images output of the pre-processor)
+    :param roi: Optional. Region of interest (ulx, uly, lrx, lry), in physical coordinates, of the outputs and of the
+                intermediate results
 
     :return output, (sources): if output path is not specified, returns reconstructed in-memory pyotb object
                                optionally, if with_indermediate, also returns the input sources
@@ -70,9 +74,11 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
     products_dic = {'s2_t': [s2t_product], 's2_tp1': s2tp1_products, 's2_tm1': s2tm1_products,
                     's1_t': s1t_products, 's1_tp1': s1tp1_products, 's1_tm1': s1tm1_products}
 
-    # Splitting every product lists into 2 lists: list of images and list of dates
+    # Splitting every product lists into 2 lists: list of images and list of dates.
+    # The rasters and timestamps are computed once per product, and reused in the following
     images = {k: [product.get_raster_10m() for product in products] for k, products in products_dic.items()}
-    dates = {k: [str(product.get_timestamp()) for product in products] for k, products in products_dic.items()}
+    timestamps = {k: [product.get_timestamp() for product in products] for k, products in products_dic.items()}
+    dates = {k: [str(timestamp) for timestamp in k_timestamps] for k, k_timestamps in timestamps.items()}
 
     # Handling potential 20m bands
     if with_20m_bands:
@@ -93,14 +99,12 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
                                                            timestampsopt=dates['s2_tp1'], sorting="des")
 
     # For T date, there is only one S2 image, thus a simple mosaic of S1 images with the closest ones on top
-    def _closest_date(x):
-        """Helper to sort S1 products"""
-        return abs(s2t_product.get_timestamp() - x.get_timestamp())
-
-    s1t_products.sort(key=_closest_date, reverse=True)
+    # (i.e. sorted from the farthest to the closest, the stable sort keeps the input order of the products with the
+    # same gap)
+    gaps = np.abs(np.array(timestamps['s1_t']) - timestamps['s2_t'][0])
     # Getting the 10m rasters
-    input_s1_images_10m = [product.get_raster_10m() for product in s1t_products]
-    s2t = s2t_product.get_raster_10m()
+    input_s1_images_10m = [images['s1_t'][i] for i in np.argsort(-gaps, kind='stable')]
+    s2t = images['s2_t'][0]
 
     sources = {'s1_tm1': preprocessor_tm1.outsar1,
                's2_tm1': preprocessor_tm1.outopt1,
@@ -127,7 +131,21 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
 
     # OTB extended filename that will be used for all writing
     filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
-                          "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES".format(ts))
+                          "gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS&"
+                          "gdal:co:TILED=YES".format(ts))
+
+    # Region of interest of the outputs. The sources of the model are not cropped, so that the pixels near the ROI
+    # borders are reconstructed with the same context as for the whole image
+    def _extract_roi(image):
+        """Helper to extract the region of interest of an output"""
+        if not roi:
+            return image
+        ulx, uly, lrx, lry = roi
+        return pyotb.ExtractROI({'in': image, 'mode': 'extent', 'mode.extent.unit': 'phy',
+                                 'mode.extent.ulx': ulx, 'mode.extent.uly': uly,
+                                 'mode.extent.lrx': lrx, 'mode.extent.lry': lry}, propagate_pixel_type=True)
+
+    intermediate_sources = {name: _extract_roi(source) for name, source in sources.items()} if roi else sources
 
     # Inference
     if with_20m_bands:
@@ -139,18 +157,21 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
                                         out_pixeltype=s2t_product.get_raster_10m_encoding(),
                                         nodatavalues={"s1_tm1": 0, "s2_tm1": -10000, "s1_tp1": 0,
                                                       "s2_tp1": -10000, "s1_t": 0, "s2_t": -10000})
+        resampled_all_bands = _extract_roi(resampled_all_bands)
 
         # If the user didn't specify output paths, return in-memory object
         if not (output and output_20m):
             if with_intermediate:
-                return resampled_all_bands, sources
+                return resampled_all_bands, intermediate_sources
             return resampled_all_bands
 
-        # temporary path for the stack of 10m+20m bands
+        # temporary path for the stack of 10m+20m bands. The stack is written once, so that the 10m and 20m outputs
+        # don't run the inference twice. It is not compressed since it is read only once then removed.
         temp_outpath = system.join(system.dirname(output_20m),
                                    'temp_all_bands_' + system.basename(output_20m))
         resampled_all_bands.write(out=temp_outpath,
-                                  filename_extension=filename_extension)
+                                  filename_extension="&streaming:type=tiled&streaming:sizemode=height&"
+                                                     "streaming:sizevalue={}&gdal:co:TILED=YES".format(ts))
 
         stack = pyotb.Input(temp_outpath)
         # Writing 10m bands
@@ -171,21 +192,24 @@ def crga_processor(il_s1after, il_s1before, il_s1, il_s2after, il_s2before, in_s
                                   out_pixeltype=s2t_product.get_raster_10m_encoding(),
                                   nodatavalues={"s1_tm1": 0, "s2_tm1": -10000, "s1_tp1": 0,
                                                 "s2_tp1": -10000, "s1_t": 0, "s2_t": -10000})
+        processed_10m = _extract_roi(processed_10m)
 
         # If the user didn't specify output path, return in-memory object
         if not output:
             if with_intermediate:
-                return processed_10m, sources
+                return processed_10m, intermediate_sources
             return processed_10m
 
         processed_10m.write(out=output, filename_extension=filename_extension)
 
     if with_intermediate and output:
-        # Writing the outputs of Preprocessor, in the same directory as output with a suffix
-        for name, source in sources.items():
+        # Writing the outputs of Preprocessor, in the same directory as output with a suffix.
+        # They are written one after the other: the pipelines share upstream OTB applications (e.g. the DEM, s2t and
+        # the Sentinel-1 images), and an ITK pipeline can't be updated from several threads at once
+        for name, source in intermediate_sources.items():
             if name != 'dem':
                 source.write(os.path.splitext(output)[0] + '_{}.tif'.format(name),
-                             pixel_type=products_dic[name][0].get_raster_10m_encoding(),
+                             pixel_type=products_dic[name.replace('_20m', '')][0].get_raster_10m_encoding(),
                              filename_extension=filename_extension)
 
 
@@ -226,11 +250,26 @@ def main():
     parser.add_argument('--maxgap', default=72, type=int,
                         help="Max gap (in hours) between S1 and S2 images for the selection of before and after pairs.")
 
+    parser.add_argument('--xla', dest='xla', action='store_true',
+                        help="Compile the model with XLA. Can speed up the inference, especially on GPU")
+    parser.set_defaults(xla=False)
+    parser.add_argument('--gdal_cache_mb', type=int, help="GDAL block cache size, in MB. Optional")
+    parser.add_argument('--tf_intra', type=int, help="Number of TensorFlow intra-op threads. Optional")
+    parser.add_argument('--tf_inter', type=int, help="Number of TensorFlow inter-op threads. Optional")
+
     if len(sys.argv) == 1:
         parser.print_help()
         parser.exit()
 
     params = parser.parse_args()
+    system.set_runtime_env(gdal_cache_mb=params.gdal_cache_mb, tf_intra=params.tf_intra, tf_inter=params.tf_inter)
+
+    if params.xla:
+        # The SavedModel is run by the OTBTF C++ session, hence XLA is enabled with auto-clustering (CPU and GPU).
+        # The streamed regions have the same size (except at the image border), so the compiled model is reused for
+        # most of them. TensorFlow reads this process-wide setting once, so it is set here and not by the library
+        logging.info("Using XLA")
+        system.set_env_var("TF_XLA_FLAGS", "--tf_xla_auto_jit=2 --tf_xla_cpu_global_jit")
 
     crga_processor(params.il_s1after, params.il_s1before, params.il_s1, params.il_s2after, params.il_s2before,
                    params.in_s2, params.dem, params.savedmodel,
@@ -27,37 +27,40 @@ import datetime
 import os
 import sys
 import logging
-import heapq
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from decloud.core import system
-from decloud.production.products import Factory as ProductsFactory
+from decloud.production.products import Factory as ProductsFactory, timestamps_array, as_pyotb, is_all_nodata
 from decloud.production.crga_processor import crga_processor
-import pyotb
 
 
-def get_nclosest(n, s2t, product_dic, period=None):
+def get_nclosest(n, s2t_timestamp, paths, timestamps, period=None):
     """
     Finds the n temporally closest images of a given S2 product.
 
     :param n: number of images to select
-    :param s2t: S2ProductBase image
-    :param product_dic: ProductBase images
+    :param s2t_timestamp: timestamp of the S2 product
+    :param paths: numpy array of the candidate products filepaths
+    :param timestamps: numpy array of the candidate products timestamps, sorted in ascending order (same order as
+                       paths)
     :param period: Optional. Period of interest, can be 'before' or 'after' or any
     :return res: list of filepaths
     """
 
-    # Searching for candidates and gathering as dictionary {product:timedelta}
+    # Binary search of the S2 product among the sorted timestamps: products before are in [0, first),
+    # products after are in [last, len)
+    first = np.searchsorted(timestamps, s2t_timestamp, side='left')
+    last = np.searchsorted(timestamps, s2t_timestamp, side='right')
     if period == 'before':
-        candidates = dict([(file, s2t.get_date() - product.get_date())
-                           for file, product in product_dic.items() if product.get_date() < s2t.get_date()])
+        best = np.arange(max(first - n, 0), first)[::-1]
     elif period == 'after':
-        candidates = dict([(file, product.get_date() - s2t.get_date())
-                           for file, product in product_dic.items() if product.get_date() > s2t.get_date()])
+        best = np.arange(last, min(last + n, len(timestamps)))
     else:
-        candidates = dict([(file, abs(product.get_date() - s2t.get_date())) for file, product in product_dic.items()])
-
-    # selecting the N best among the candidates
-    res = heapq.nsmallest(n, candidates, key=candidates.get)
+        # the n closest products are among the n products on each side of the S2 product
+        candidates = np.arange(max(first - n, 0), min(first + n, len(timestamps)))
+        deltas = np.abs(timestamps[candidates] - s2t_timestamp)
+        best = candidates[np.argsort(deltas, kind='stable')[:n]]
+    res = paths[best].tolist()
 
     return res
 
@@ -99,12 +102,16 @@ if __name__ == "__main__":
     parser.add_argument('--skip_nodata_images', dest='skip_nodata_images', action='store_true',
                         help="Whether to skip the reconstruction of the optical image if it is all NoData")
     parser.set_defaults(skip_nodata_images=False)
+    parser.add_argument('--gdal_cache_mb', type=int, help="GDAL block cache size, in MB. Optional")
+    parser.add_argument('--tf_intra', type=int, help="Number of TensorFlow intra-op threads. Optional")
+    parser.add_argument('--tf_inter', type=int, help="Number of TensorFlow inter-op threads. Optional")
 
     if len(sys.argv) == 1:
         parser.print_help()
         parser.exit()
 
     params = parser.parse_args()
+    system.set_runtime_env(gdal_cache_mb=params.gdal_cache_mb, tf_intra=params.tf_intra, tf_inter=params.tf_inter)
 
     if not (params.il_s2 or params.s2_dir):
         raise Exception('Missing --il_s2 or --s2_dir argument')
@@ -120,19 +127,17 @@ if __name__ == "__main__":
 
     # Getting all the S2 filepaths
     if params.s2_dir:
-        s2_image_paths = [os.path.join(params.s2_dir, name) for name in os.listdir(params.s2_dir)]
+        s2_image_paths = ProductsFactory.list_candidates(params.s2_dir, 's2')
     elif params.il_s2[0].endswith('.txt'):
-        with open(params.il_s2[0], 'r') as f:
-            s2_image_paths = [x.strip() for x in f.readlines()]
+        s2_image_paths = system.read_lines(params.il_s2[0])
     else:
         s2_image_paths = params.il_s2
 
     # Getting all the S1 filepaths
     if params.s1_dir:
-        s1_image_paths = [os.path.join(params.s1_dir, name) for name in os.listdir(params.s1_dir)]
+        s1_image_paths = ProductsFactory.list_candidates(params.s1_dir, 's1')
     elif params.il_s1[0].endswith('.txt'):
-        with open(params.il_s1[0], 'r') as f:
-            s1_image_paths = [x.strip() for x in f.readlines()]
+        s1_image_paths = system.read_lines(params.il_s1[0])
     else:
         s1_image_paths = params.il_s1
 
@@ -140,9 +145,12 @@ if __name__ == "__main__":
     input_s2_products, input_s1_products = {}, {}
     for imtype, image_paths, input_products in zip(['s2', 's1'], [s2_image_paths, s1_image_paths],
                                                    [input_s2_products, input_s1_products]):
+        # Products creation is mostly I/O (metadata files reading), hence the threads
+        with ThreadPoolExecutor() as executor:
+            products = list(executor.map(lambda path: ProductsFactory.create(path, imtype, verbose=False),
+                                         image_paths))
         product_count, invalid_count = 0, 0
-        for product_path in image_paths:
-            product = ProductsFactory.create(product_path, imtype, verbose=False)
+        for product_path, product in zip(image_paths, products):
             if product:
                 input_products[product_path] = product
                 product_count += 1
@@ -164,22 +172,43 @@ if __name__ == "__main__":
 
     # OTB extended filename that will be used for all writing
     filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
-                          "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES".format(params.ts))
+                          "gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS&"
+                          "gdal:co:TILED=YES".format(params.ts))
+
+    # ROI extraction parameters. The reconstructed image and the intermediate results are extracted by crga_processor
+    roi, roi_kwargs = None, None
+    if params.lrx and params.lry and params.ulx and params.uly:
+        roi = (params.ulx, params.uly, params.lrx, params.lry)
+        roi_kwargs = {'mode': 'extent', 'mode.extent.unit': 'phy',
+                      'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
+                      'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry}
+
+    # Timestamps of the products, computed once for all the dates, and sorted for the search of the closest products
+    s2_paths = np.array(list(input_s2_products))
+    s2_timestamps = timestamps_array(input_s2_products.values())
+    s1_paths = np.array(list(input_s1_products))
+    s1_timestamps = timestamps_array(input_s1_products.values())
+    s2_order = np.argsort(s2_timestamps, kind='stable')
+    s2_sorted_paths, s2_sorted_timestamps = s2_paths[s2_order], s2_timestamps[s2_order]
+    s1_order = np.argsort(s1_timestamps, kind='stable')
+    s1_paths, s1_timestamps = s1_paths[s1_order], s1_timestamps[s1_order]
+
+    # S2 products to reconstruct, i.e. within the user timerange. The products outside of the timerange remain
+    # candidates for the T-1, T+1 and S1 images
+    s2_targets = [(s2_timestamp, s2_filepath, s2t_product)
+                  for s2_timestamp, (s2_filepath, s2t_product) in zip(s2_timestamps, input_s2_products.items())
+                  if not (params.start and s2t_product.get_date() < start)
+                  if not (params.end and s2t_product.get_date() > end)]
 
     # looping through the dates
-    for s2_filepath, s2t_product in input_s2_products.items():
-        if (params.start and s2t_product.get_date() < start) or (params.end and s2t_product.get_date() > end):
-            # skipping invalid timerange product
-            continue
-
-        output_filename = os.path.splitext(os.path.basename(s2_filepath))[0]+'_reconstructed.tif'
-        output_path = os.path.join(params.out_dir, output_filename)
+    for s2_timestamp, s2_filepath, s2t_product in s2_targets:
+        output_path = system.join(params.out_dir, system.new_bname(s2_filepath, 'reconstructed') + '.tif')
         if params.overwrite or (not os.path.exists(output_path)):
-            s2tp1_paths = get_nclosest(s2_Nimages, s2t_product, input_s2_products, 'after')
-            s2tm1_paths = get_nclosest(s2_Nimages, s2t_product, input_s2_products, 'before')
-            s1t_paths = get_nclosest(s1_Nimages, s2t_product, input_s1_products)
-            s1tp1_paths = get_nclosest(s1_Nimages, s2t_product, input_s1_products, 'after')
-            s1tm1_paths = get_nclosest(s1_Nimages, s2t_product, input_s1_products, 'before')
+            s2tp1_paths = get_nclosest(s2_Nimages, s2_timestamp, s2_sorted_paths, s2_sorted_timestamps, 'after')
+            s2tm1_paths = get_nclosest(s2_Nimages, s2_timestamp, s2_sorted_paths, s2_sorted_timestamps, 'before')
+            s1t_paths = get_nclosest(s1_Nimages, s2_timestamp, s1_paths, s1_timestamps)
+            s1tp1_paths = get_nclosest(s1_Nimages, s2_timestamp, s1_paths, s1_timestamps, 'after')
+            s1tm1_paths = get_nclosest(s1_Nimages, s2_timestamp, s1_paths, s1_timestamps, 'before')
 
             if any([len(paths) == 0 for paths in [s1tp1_paths, s1tm1_paths, s1t_paths, s2tp1_paths, s2tm1_paths]]):
                 logging.warning('Could not find some T-1 or T+1 or S1T products. '
@@ -187,33 +216,17 @@ if __name__ == "__main__":
                 continue
 
             # Potentially skip the inference if the s2_t image is all NoData
-            if params.skip_nodata_images:
-                # we consider the 20m image (because it is smaller than 10m image)
-                s2t_20m = s2t_product.get_raster_20m()
-                # If needed, extracting ROI of all rasters
-                if params.lrx and params.lry and params.ulx and params.uly:
-                    s2t_20m = pyotb.ExtractROI({'in': s2t_20m, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                                'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                                'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry})
-                s2t_20m = pyotb.Input(s2t_20m) if isinstance(s2t_20m, str) else s2t_20m
-                if np.max(np.asarray(s2t_20m)) <= 0:
-                    logging.warning(f'SKIPPING all NoData image: {s2_filepath}')
-                    continue
+            if params.skip_nodata_images and is_all_nodata(s2t_product, roi_kwargs):
+                logging.warning(f'SKIPPING all NoData image: {s2_filepath}')
+                continue
 
             if params.write_intermediate:
                 processor, sources = crga_processor(s1tp1_paths, s1tm1_paths, s1t_paths, s2tp1_paths, s2tm1_paths,
                                                     s2_filepath, params.dem, params.model, ts=params.ts,
-                                                    with_intermediate=True)
+                                                    with_intermediate=True, roi=roi)
             else:
                 processor = crga_processor(s1tp1_paths, s1tm1_paths, s1t_paths, s2tp1_paths, s2tm1_paths,
-                                           s2_filepath, params.dem, params.model, ts=params.ts)
-
-            # If needed, extracting ROI of the reconstructed image
-            if params.lrx and params.lry and params.ulx and params.uly:
-                processor = pyotb.ExtractROI({'in': processor, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                              'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                              'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry},
-                                             propagate_pixel_type=True)
+                                           s2_filepath, params.dem, params.model, ts=params.ts, roi=roi)
 
             # Writing result
             processor.write(out=output_path, filename_extension=filename_extension)
@@ -222,14 +235,5 @@ if __name__ == "__main__":
             if params.write_intermediate:
                 for name, image in sources.items():
                     if name != 'dem':
-                        # If needed, extracting ROI
-                        if params.lrx and params.lry and params.ulx and params.uly:
-                            image = pyotb.ExtractROI({'in': image, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                                      'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                                      'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry},
-                                                     propagate_pixel_type=True)
-
-                        if isinstance(image, str):  # if needed transform the filepath to pyotb in-memory object
-                            image = pyotb.Input(image)
-                        image.write(os.path.join(params.out_dir, output_filename.replace('reconstructed', name)),
-                                    pixel_type='int32', filename_extension=filename_extension)
+                        out_path = system.join(params.out_dir, system.new_bname(s2_filepath, name) + '.tif')
+                        as_pyotb(image).write(out_path, pixel_type='int32', filename_extension=filename_extension)
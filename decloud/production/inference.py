@@ -69,21 +69,13 @@ def inference(sources, sources_scales, pad, ts, savedmodel_dir, out_tensor, out_
     parameters = {}
 
     # Inputs
-    for i, (placeholder, source) in enumerate(sources.items()):
-        logging.info("Preparing source {} for placeholder {}".format(i + 1, placeholder))
-
-        def get_key(key):
-            """ Return the parameter key for the current source """
-            return "source{}.{}".format(i + 1, key)
-
-        src_rfield = rfield
-        if placeholder in sources_scales:
-            src_rfield = int(rfield / sources_scales[placeholder])
-
-        parameters.update({get_key("il"): [source],
-                           get_key("rfieldx"): src_rfield,
-                           get_key("rfieldy"): src_rfield,
-                           get_key("placeholder"): placeholder})
+    for i, (placeholder, source) in enumerate(sources.items(), start=1):
+        logging.info("Preparing source {} for placeholder {}".format(i, placeholder))
+        src_rfield = int(rfield / sources_scales[placeholder]) if placeholder in sources_scales else rfield
+        parameters.update({f"source{i}.il": [source],
+                           f"source{i}.rfieldx": src_rfield,
+                           f"source{i}.rfieldy": src_rfield,
+                           f"source{i}.placeholder": placeholder})
 
     # Model
     parameters.update({"model.dir": savedmodel_dir, "model.fullyconv": True,
@@ -100,20 +92,20 @@ def inference(sources, sources_scales, pad, ts, savedmodel_dir, out_tensor, out_
 
     # Applying the NoDatas from input sources to the output result
     if nodatavalues:
-        # Potentially transform filepath to pyotb object
-        sources = {k: pyotb.Input(v) if isinstance(v, str) else v for k, v in sources.items()}
-        # Defining valid data masks for each source (1=valid data, 0=NoData); i.e. when at least one band is not NoData
-        source_masks = [pyotb.any((sources[placeholder] != nodata)) for placeholder, nodata in nodatavalues.items()]
-        # Merging all the masks: all sources must be valid for the merged mask to be considered valid
-        merged_mask = pyotb.all(*source_masks)
-
-        # Closing post processing mask to remove small groups of NoData pixels
-        closing = pyotb.BinaryMorphologicalOperation(merged_mask, filter="closing", foreval=1, structype="box",
-                                                     xradius=5, yradius=5)
-
-        # Erode post processing mask
-        erode = pyotb.BinaryMorphologicalOperation(closing, filter="erode", foreval=1, structype="box",
-                                                   xradius=pad, yradius=pad)
+        # Valid data mask (1=valid data, 0=NoData), computed in a single application: a source is valid when at least
+        # one band is not NoData (i.e. its min or its max differs from the NoData value), and all sources must be valid
+        valid_exps = ["(vmin(im{0}) != {1} || vmax(im{0}) != {1})".format(i, nodata)
+                      for i, nodata in enumerate(nodatavalues.values(), start=1)]
+        merged_mask = pyotb.BandMathX(il=[sources[placeholder] for placeholder in nodatavalues],
+                                      exp="({}) ? 1 : 0".format(" && ".join(valid_exps)))
+
+        # Closing post processing mask to remove small groups of NoData pixels, then erode post processing mask.
+        # A closing is a dilation followed by an erosion, and two successive box erosions are a single box erosion
+        # with the sum of the radii: the closing erosion and the pad erosion are merged
+        dilate = pyotb.BinaryMorphologicalOperation(merged_mask, filter="dilate", foreval=1, structype="box",
+                                                    xradius=5, yradius=5)
+        erode = pyotb.BinaryMorphologicalOperation(dilate, filter="erode", foreval=1, structype="box",
+                                                   xradius=5 + pad, yradius=5 + pad)
 
         # Superimpose the eroded post processing mask
         resample = pyotb.Superimpose(inm=erode, interpolator="nn", lms=192, inr=infer)
@@ -26,7 +26,8 @@ import argparse
 import os
 import sys
 
-from decloud.production.products import Factory as ProductsFactory
+import numpy as np
+from decloud.production.products import Factory as ProductsFactory, timestamps_array
 from decloud.production.inference import inference
 import decloud.preprocessing.constants as constants
 from decloud.core import system
@@ -57,16 +58,14 @@ def meraner_processor(il_s1, in_s2, savedmodel, dem=None, output=None, output_20
     s2t_product = ProductsFactory.create(in_s2, 's2')
     input_s1_products = [ProductsFactory.create(pth, 's1') for pth in il_s1]
 
-    def _closest_date(x):
-        """
-        Helper to sort S1 products
-        :param x: input product
-        :return: rank
-        """
-        return abs(s2t_product.get_timestamp() - x.get_timestamp())
-
-    input_s1_products.sort(key=_closest_date, reverse=True)
-    input_s1_products = input_s1_products[:s1_Nimages]
+    # Keeping the s1_Nimages closest S1 products (partial selection), with the closest ones on top of the mosaic
+    # (i.e. last)
+    gaps = np.abs(timestamps_array(input_s1_products) - s2t_product.get_timestamp())
+    selected = np.arange(len(gaps))
+    if len(gaps) > s1_Nimages:
+        selected = np.sort(np.argpartition(gaps, s1_Nimages - 1)[:s1_Nimages])
+    selected = selected[np.argsort(-gaps[selected], kind='stable')]
+    input_s1_products = [input_s1_products[i] for i in selected]
 
     # Getting the 10m rasters
     input_s1_images_10m = [product.get_raster_10m() for product in input_s1_products]
@@ -86,7 +85,8 @@ def meraner_processor(il_s1, in_s2, savedmodel, dem=None, output=None, output_20
 
     # OTB extended filename that will be used for all writing
     filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
-                          "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES".format(ts))
+                          "gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS&"
+                          "gdal:co:TILED=YES".format(ts))
 
     # Inference
     if with_20m_bands:
@@ -103,9 +103,12 @@ def meraner_processor(il_s1, in_s2, savedmodel, dem=None, output=None, output_20
                 return resampled_all_bands, sources
             return resampled_all_bands
 
-        # temporary path for the stack of 10m+20m bands
+        # temporary path for the stack of 10m+20m bands. The stack is written once, so that the 10m and 20m outputs
+        # don't run the inference twice. It is not compressed since it is read only once then removed.
         temp_outpath = system.join(system.dirname(output_20m), 'temp_all_bands_' + system.basename(output_20m))
-        resampled_all_bands.write(out=temp_outpath, filename_extension=filename_extension)
+        resampled_all_bands.write(out=temp_outpath,
+                                  filename_extension="&streaming:type=tiled&streaming:sizemode=height&"
+                                                     "streaming:sizevalue={}&gdal:co:TILED=YES".format(ts))
 
         stack = pyotb.Input(temp_outpath)
         # Writing 10m bands
@@ -23,18 +23,90 @@ DEALINGS IN THE SOFTWARE.
 """
 """Process time series with Meraner-like models"""
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import datetime
 import os
+import re
 import sys
 import logging
 from decloud.core import system
-import numpy as np
 
-from decloud.production.products import Factory as ProductsFactory
+from decloud.production.products import Factory as ProductsFactory, as_pyotb, is_all_nodata
 from decloud.production.meraner_processor import meraner_processor
 import pyotb
 
-if __name__ == "__main__":
+
+def date_from_filename(filepath):
+    """
+    Cheap retrieval of the acquisition day of a Sentinel-2 product from its file name, without reading its metadata
+    :param filepath: path of the Sentinel-2 product
+    :return: the acquisition day as a datetime.date, or None if the file name does not encode it
+    """
+    match = re.search(r'_(\d{8})[T-]\d{6}', os.path.basename(os.path.normpath(filepath)))
+    if match:
+        try:
+            return datetime.datetime.strptime(match.group(1), '%Y%m%d').date()
+        except ValueError:
+            pass
+    return None
+
+
+def reconstruct(s2_filepath, il_s1, params):
+    """
+    Reconstruct one Sentinel-2 image of the time series
+    :param s2_filepath: path of the Sentinel-2 product to reconstruct
+    :param il_s1: paths of the Sentinel-1 products
+    :param params: parameters
+    """
+    # OTB extended filename that will be used for all writing
+    filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
+                          "gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS&"
+                          "gdal:co:TILED=YES".format(params.ts))
+
+    # ROI extraction parameters, shared by all the extracted rasters
+    roi_kwargs = None
+    if params.lrx and params.lry and params.ulx and params.uly:
+        roi_kwargs = {'mode': 'extent', 'mode.extent.unit': 'phy',
+                      'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
+                      'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry}
+
+    output_path = system.join(params.out_dir, system.new_bname(s2_filepath, 'reconstructed') + '.tif')
+    if params.overwrite or (not os.path.exists(output_path)):
+        # Potentially skip the inference if the s2_t image is all NoData
+        if params.skip_nodata_images and is_all_nodata(ProductsFactory.create(s2_filepath, 's2', verbose=False),
+                                                       roi_kwargs):
+            logging.warning(f'SKIPPING all NoData image: {s2_filepath}')
+            return
+
+        if params.write_intermediate:
+            processor, sources = meraner_processor(il_s1, s2_filepath, params.model, params.dem, s1_Nimages=12,
+                                                   ts=params.ts, with_intermediate=True)
+        else:
+            processor = meraner_processor(il_s1, s2_filepath, params.model, params.dem, s1_Nimages=12,
+                                          ts=params.ts)
+
+        # If needed, extracting ROI of the reconstructed image
+        if roi_kwargs:
+            processor = pyotb.ExtractROI({'in': processor, **roi_kwargs}, propagate_pixel_type=True)
+
+        processor.write(out=output_path, filename_extension=filename_extension)
+
+        # Writing the inputs sources of the model. They are written one after the other: the pipelines share upstream
+        # OTB applications (e.g. the DEM and the Sentinel-1 images), and an ITK pipeline can't be updated from several
+        # threads at once
+        if params.write_intermediate:
+            for name, source in sources.items():
+                if name != 'dem':
+                    source = as_pyotb(source)
+                    # If needed, extracting ROI of every rasters
+                    if roi_kwargs:
+                        source = pyotb.ExtractROI({'in': source, **roi_kwargs}, propagate_pixel_type=True)
+                    out_path = system.join(params.out_dir, system.new_bname(s2_filepath, name) + '.tif')
+                    source.write(out_path, pixel_type='int32', filename_extension=filename_extension)
+
+
+def main():
+    """ Reconstruct the Sentinel-2 images of a time series """
     # Logger
     system.basic_logging_init()
 
@@ -71,12 +143,17 @@ if __name__ == "__main__":
     parser.add_argument('--skip_nodata_images', dest='skip_nodata_images', action='store_true',
                         help="Whether to skip the reconstruction of the optical image if it is all NoData")
     parser.set_defaults(skip_nodata_images=False)
+    parser.add_argument('--jobs', type=int, default=1, help="Number of Sentinel-2 images reconstructed in parallel")
+    parser.add_argument('--gdal_cache_mb', type=int, help="GDAL block cache size, in MB. Optional")
+    parser.add_argument('--tf_intra', type=int, help="Number of TensorFlow intra-op threads. Optional")
+    parser.add_argument('--tf_inter', type=int, help="Number of TensorFlow inter-op threads. Optional")
 
     if len(sys.argv) == 1:
         parser.print_help()
         parser.exit()
 
     params = parser.parse_args()
+    system.set_runtime_env(gdal_cache_mb=params.gdal_cache_mb, tf_intra=params.tf_intra, tf_inter=params.tf_inter)
 
     if not (params.il_s2 or params.s2_dir):
         raise Exception('Missing --il_s2 or --s2_dir argument')
@@ -92,27 +169,41 @@ if __name__ == "__main__":
 
     # Getting all the S2 filepaths
     if params.s2_dir:
-        s2_image_paths = [os.path.join(params.s2_dir, name) for name in os.listdir(params.s2_dir)]
+        s2_image_paths = ProductsFactory.list_candidates(params.s2_dir, 's2')
     elif params.il_s2[0].endswith('.txt'):
-        with open(params.il_s2[0], 'r') as f:
-            s2_image_paths = [x.strip() for x in f.readlines()]
+        s2_image_paths = system.read_lines(params.il_s2[0])
     else:
         s2_image_paths = params.il_s2
 
     # Getting all the S1 filepaths
     if params.s1_dir:
-        s1_image_paths = [os.path.join(params.s1_dir, name) for name in os.listdir(params.s1_dir)]
+        s1_image_paths = ProductsFactory.list_candidates(params.s1_dir, 's1')
     elif params.il_s1[0].endswith('.txt'):
-        with open(params.il_s1[0], 'r') as f:
-            s1_image_paths = [x.strip() for x in f.readlines()]
+        s1_image_paths = system.read_lines(params.il_s1[0])
     else:
         s1_image_paths = params.il_s1
 
+    if params.start or params.end:
+        logging.info('Filtering timerange of inputs products, to match user timerange : '
+                     'From {} to {}'.format(params.start, params.end))
+        start = datetime.datetime.strptime(params.start, '%Y-%m-%d') if params.start else None
+        end = datetime.datetime.strptime(params.end, '%Y-%m-%d') if params.end else None
+
+        # Discard the S2 paths whose file name date is out of the timerange, before reading their metadata. Paths
+        # without date in their name are kept, the products dates are checked afterwards anyway
+        def _maybe_in_timerange(path):
+            """Returns False only if the file name date of the product is out of the user timerange"""
+            day = date_from_filename(path)
+            return day is None or not ((start and day < start.date()) or (end and day > end.date()))
+        s2_image_paths = [path for path in s2_image_paths if _maybe_in_timerange(path)]
+
     # Converting filepaths to S2 products
     input_s2_products = {}
+    # Products creation is mostly I/O (metadata files reading), hence the threads
+    with ThreadPoolExecutor() as executor:
+        products = list(executor.map(lambda path: ProductsFactory.create(path, 's2', verbose=False), s2_image_paths))
     product_count, invalid_count = 0, 0
-    for product_path in s2_image_paths:
-        product = ProductsFactory.create(product_path, 's2', verbose=False)
+    for product_path, product in zip(s2_image_paths, products):
         if product:
             input_s2_products[product_path] = product
             product_count += 1
@@ -123,9 +214,11 @@ if __name__ == "__main__":
 
     # Converting filepaths to S1 products
     input_s1_products = {}
+    # Products creation is mostly I/O (metadata files reading), hence the threads
+    with ThreadPoolExecutor() as executor:
+        products = list(executor.map(lambda path: ProductsFactory.create(path, 's1', verbose=False), s1_image_paths))
     product_count, invalid_count = 0, 0
-    for product_path in s1_image_paths:
-        product = ProductsFactory.create(product_path, 's1', verbose=False)
+    for product_path, product in zip(s1_image_paths, products):
         if product:
             input_s1_products[product_path] = product
             product_count += 1
@@ -135,70 +228,26 @@ if __name__ == "__main__":
                  'Discarded {} paths that were not S1 products'.format(product_count, invalid_count))
     il_s1 = list(input_s1_products.keys())
 
-    if params.start or params.end:
-        logging.info('Filtering timerange of inputs products, to match user timerange : '
-                     'From {} to {}'.format(params.start, params.end))
-        start = datetime.datetime.strptime(params.start, '%Y-%m-%d') if params.start else None
-        end = datetime.datetime.strptime(params.end, '%Y-%m-%d') if params.end else None
-
     if not system.is_dir(params.out_dir):
         system.mkdir(params.out_dir)
 
-    # OTB extended filename that will be used for all writing
-    filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
-                          "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES".format(params.ts))
+    # Sentinel-2 images to reconstruct, in the user timerange
+    s2_filepaths = [s2_filepath for s2_filepath, s2t_product in input_s2_products.items()
+                    if not (params.start and s2t_product.get_date() < start)
+                    if not (params.end and s2t_product.get_date() > end)]
 
     # looping through the input Sentinel-2 images
-    for s2_filepath, s2t_product in input_s2_products.items():
-        if (params.start and s2t_product.get_date() < start) or (params.end and s2t_product.get_date() > end):
-            # skipping invalid timerange product
-            continue
-
-        output_filename = os.path.splitext(os.path.basename(s2_filepath))[0] + '_reconstructed.tif'
-        output_path = os.path.join(params.out_dir, output_filename)
-        if params.overwrite or (not os.path.exists(output_path)):
-            # Potentially skip the inference if the s2_t image is all NoData
-            if params.skip_nodata_images:
-                # we consider the 20m image (because it is smaller than 10m image)
-                s2t_20m = s2t_product.get_raster_20m()
-                # If needed, extracting ROI of all rasters
-                if params.lrx and params.lry and params.ulx and params.uly:
-                    s2t_20m = pyotb.ExtractROI({'in': s2t_20m, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                                'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                                'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry})
-                s2t_20m = pyotb.Input(s2t_20m) if isinstance(s2t_20m, str) else s2t_20m
-                if np.max(np.asarray(s2t_20m)) <= 0:
-                    logging.warning(f'SKIPPING all NoData image: {s2_filepath}')
-                    continue
-
-            if params.write_intermediate:
-                processor, sources = meraner_processor(il_s1, s2_filepath, params.model, params.dem, s1_Nimages=12,
-                                                       ts=params.ts, with_intermediate=True)
-            else:
-                processor = meraner_processor(il_s1, s2_filepath, params.model, params.dem, s1_Nimages=12,
-                                              ts=params.ts)
-
-            # If needed, extracting ROI of the reconstructed image
-            if params.lrx and params.lry and params.ulx and params.uly:
-                processor = pyotb.ExtractROI({'in': processor, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                              'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                              'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry},
-                                             propagate_pixel_type=True)
-
-            processor.write(out=output_path, filename_extension=filename_extension)
-
-            # Writing the inputs sources of the model
-            if params.write_intermediate:
-                for name, source in sources.items():
-                    if name != 'dem':
-                        # If needed, extracting ROI of every rasters
-                        if params.lrx and params.lry and params.ulx and params.uly:
-                            source = pyotb.ExtractROI({'in': source, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                                       'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                                       'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry},
-                                                      propagate_pixel_type=True)
-
-                        if isinstance(source, str):  # if needed transform the filepath to pyotb in-memory object
-                            source = pyotb.Input(source)
-                        source.write(os.path.join(params.out_dir, output_filename.replace('reconstructed', name)),
-                                     pixel_type='int32', filename_extension=filename_extension)
+    if params.jobs > 1 and len(s2_filepaths) > 1:
+        n_jobs = min(params.jobs, len(s2_filepaths))
+        n_threads = max(1, os.cpu_count() // n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=system.init_worker, initargs=(n_threads,)) as executor:
+            futures = [executor.submit(reconstruct, s2_filepath, il_s1, params) for s2_filepath in s2_filepaths]
+            for future in futures:
+                future.result()
+    else:
+        for s2_filepath in s2_filepaths:
+            reconstruct(s2_filepath, il_s1, params)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,6 +23,7 @@ DEALINGS IN THE SOFTWARE.
 """
 """Process time series with Meraner-like models"""
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
 import sys
@@ -31,7 +32,7 @@ import logging
 import otbApplication
 
 from decloud.core import system
-from decloud.preprocessing.constants import padded_tensor_name
+from decloud.preprocessing.constants import padded_tensor_name, PADS
 from decloud.production.products import Factory as ProductsFactory
 import pyotb
 
@@ -76,37 +77,29 @@ def monthly_synthesis_inference(sources, sources_scales, pad, ts, savedmodel_dir
     system.set_env_var("OTB_TF_NSOURCES", str(len(sources)))
     infer_params = {}
 
-    # Setup BandMath for post processing
-    bm_params = {}
-    mask_expr = "0"
+    # Setup BandMath for post processing: all the sources of the mask are gathered in a single input list
+    mask_sources = []
+    mask_exprs = ["0"]  # one NoData expression per source of the mask
+    nb_channels = {}  # number of channels of the sources, duplicated sources are queried once
 
     # Inputs
-    k = 0  # counter used for the im# of postprocessing mask
-    for i, (placeholder, source) in enumerate(sources.items()):
-        logging.info("Preparing source {} for placeholder {}".format(i + 1, placeholder))
-
-        def get_key(key):
-            """ Return the parameter key for the current source """
-            return "source{}.{}".format(i + 1, key)
-
-        src_rfield = rfield
-        if placeholder in sources_scales:
-            src_rfield = int(rfield / sources_scales[placeholder])
-
-        infer_params.update({get_key("il"): [source]})
+    for i, (placeholder, source) in enumerate(sources.items(), start=1):
+        logging.info("Preparing source {} for placeholder {}".format(i, placeholder))
+        src_rfield = int(rfield / sources_scales[placeholder]) if placeholder in sources_scales else rfield
+        infer_params.update({f"source{i}.il": [source],
+                             f"source{i}.rfieldx": src_rfield,
+                             f"source{i}.rfieldy": src_rfield,
+                             f"source{i}.placeholder": placeholder})
 
         # Update post processing BandMath expression
         if placeholder != 'dem' and '20m' not in placeholder:
             nodatavalue = nodatavalues[placeholder]
-            n_channels = pyotb.get_nbchannels(source)
-            mask_expr += "||"
-            mask_expr += "&&".join(["im{}b{}=={}".format(k + 1, b, nodatavalue) for b in range(1, 1 + n_channels)])
-            bm_params.update({'il': source})
-            k += 1
-
-        infer_params.update({get_key("rfieldx"): src_rfield,
-                             get_key("rfieldy"): src_rfield,
-                             get_key("placeholder"): placeholder})
+            if id(source) not in nb_channels:
+                nb_channels[id(source)] = pyotb.get_nbchannels(source)
+            n_channels = nb_channels[id(source)]
+            mask_sources.append(source)
+            k = len(mask_sources)  # im# of the source in the post processing mask
+            mask_exprs.append("&&".join(f"im{k}b{b}=={nodatavalue}" for b in range(1, 1 + n_channels)))
 
     # Model
     infer_params.update({"model.dir": savedmodel_dir, "model.fullyconv": True,
@@ -126,17 +119,16 @@ def monthly_synthesis_inference(sources, sources_scales, pad, ts, savedmodel_dir
         rmzeros = infer
 
     # Mask for post processing
-    mask_expr += "?0:255"
-    bm_params.update({'exp': mask_expr})
-    bm = pyotb.BandMath(bm_params)
+    mask_expr = "||".join(mask_exprs) + "?0:255"
+    bm = pyotb.BandMath({'il': mask_sources, 'exp': mask_expr})
 
-    # Closing post processing mask to remove small groups of NoData pixels
-    closing = pyotb.App("BinaryMorphologicalOperation", bm, filter="closing", foreval=255, structype="box",
-                        xradius=5, yradius=5)
-
-    # Erode post processing mask
-    erode = pyotb.App("BinaryMorphologicalOperation", closing, filter="erode", foreval=255, structype="box",
-                      xradius=pad, yradius=pad)
+    # Closing post processing mask to remove small groups of NoData pixels, then erode post processing mask.
+    # A closing is a dilation followed by an erosion, and two successive box erosions are a single box erosion
+    # with the sum of the radii: the closing erosion and the pad erosion are merged
+    dilate = pyotb.App("BinaryMorphologicalOperation", bm, filter="dilate", foreval=255, structype="box",
+                       xradius=5, yradius=5)
+    erode = pyotb.App("BinaryMorphologicalOperation", dilate, filter="erode", foreval=255, structype="box",
+                      xradius=5 + pad, yradius=5 + pad)
 
     # Superimpose the eroded post processing mask
     resample = pyotb.App("Superimpose", inm=erode, interpolator="nn", lms=192, inr=infer)
@@ -171,6 +163,9 @@ if __name__ == "__main__":
     parser.add_argument("--lry", help="Lower Right Y of the ROI, in geographic coordinates. Optional", type=float)
     parser.add_argument("--year", help="Starting date, format YYYY-MM-DD. Optional")
     parser.add_argument("--month", help="End date, format YYYY-MM-DD. Optional")
+    parser.add_argument('--pad', type=int, default=64, const=64, nargs="?", choices=PADS,
+                        help="Margin size for blocking artefacts removal. Smaller margins reduce the redundant "
+                             "computations between the tiles, if the model has been trained with the same margin")
     parser.add_argument('--ts', default=256, type=int,
                         help="Tile size. Tune this to process larger output image chunks, and speed up the process.")
     parser.add_argument('--overwrite', dest='overwrite', action='store_true',
@@ -179,12 +174,16 @@ if __name__ == "__main__":
     parser.add_argument('--write_intermediate', dest='write_intermediate', action='store_true',
                         help="Whether to write S1t & S2t input rasters used by the model.")
     parser.set_defaults(write_intermediate=False)
+    parser.add_argument('--gdal_cache_mb', type=int, help="GDAL block cache size, in MB. Optional")
+    parser.add_argument('--tf_intra', type=int, help="Number of TensorFlow intra-op threads. Optional")
+    parser.add_argument('--tf_inter', type=int, help="Number of TensorFlow inter-op threads. Optional")
 
     if len(sys.argv) == 1:
         parser.print_help()
         parser.exit()
 
     params = parser.parse_args()
+    system.set_runtime_env(gdal_cache_mb=params.gdal_cache_mb, tf_intra=params.tf_intra, tf_inter=params.tf_inter)
 
     if not (params.il_s2 or params.s2_dir):
         raise Exception('Missing --il_s2 or --s2_dir argument')
@@ -195,18 +194,19 @@ if __name__ == "__main__":
 
     # Getting all the S2 filepaths
     if params.s2_dir:
-        s2_image_paths = [os.path.join(params.s2_dir, name) for name in os.listdir(params.s2_dir)]
+        s2_image_paths = ProductsFactory.list_candidates(params.s2_dir, 's2')
     elif params.il_s2[0].endswith('.txt'):
-        with open(params.il_s2[0], 'r') as f:
-            s2_image_paths = [x.strip() for x in f.readlines()]
+        s2_image_paths = system.read_lines(params.il_s2[0])
     else:
         s2_image_paths = params.il_s2
 
     # Converting filepaths to S2 products
     input_s2_products = {}
+    # Products creation is mostly I/O (metadata files reading), hence the threads
+    with ThreadPoolExecutor() as executor:
+        products = list(executor.map(lambda path: ProductsFactory.create(path, 's2', verbose=False), s2_image_paths))
     product_count, invalid_count = 0, 0
-    for product_path in s2_image_paths:
-        product = ProductsFactory.create(product_path, 's2', verbose=False)
+    for product_path, product in zip(s2_image_paths, products):
         if product:
             input_s2_products[product_path] = product
             product_count += 1
@@ -224,13 +224,16 @@ if __name__ == "__main__":
     # ==================
     central_date = datetime.datetime(int(params.year), int(params.month), 15)
     delta_days = 22
+    # bounds (excluded) of the dates of the candidates
+    min_date = central_date - datetime.timedelta(days=delta_days)
+    max_date = central_date + datetime.timedelta(days=delta_days)
     model_nb_images = 6
 
     # looping through the files
     candidates = []
     for s2_filepath, s2_product in input_s2_products.items():
         # We consider only images with no NoData
-        if (abs(s2_product.get_date() - central_date) < datetime.timedelta(days=delta_days) and
+        if (min_date < s2_product.get_date() < max_date and
                 s2_product.get_nodata_percentage() < 0.05):
             candidates.append(s2_product)
 
@@ -244,10 +247,14 @@ if __name__ == "__main__":
         candidates.sort(key=lambda x: x.get_cloud_percentage())
         candidates = [candidates[0]] * (model_nb_images - len(candidates)) + candidates
 
-    # Gathering as a dictionary
-    sources = {}
+    # Gathering as a dictionary. The duplicated candidates share the same raster object (filepaths are opened once),
+    # so that their placeholders are fed by the same pipeline
+    sources, rasters_10m = {}, {}
     for i, candidate in enumerate(candidates):
-        sources.update({'s2_t{}'.format(i): candidate.get_raster_10m()})
+        if candidate.product_path not in rasters_10m:
+            raster_10m = candidate.get_raster_10m()
+            rasters_10m[candidate.product_path] = pyotb.Input(raster_10m) if isinstance(raster_10m, str) else raster_10m
+        sources.update({'s2_t{}'.format(i): rasters_10m[candidate.product_path]})
 
     # Sources scales
     sources_scales = {}
@@ -258,34 +265,38 @@ if __name__ == "__main__":
 
     # Inference
     out_tensor = "s2_estim"
-    processor = monthly_synthesis_inference(sources=sources, sources_scales=sources_scales, pad=64,
+    processor = monthly_synthesis_inference(sources=sources, sources_scales=sources_scales, pad=params.pad,
                                             ts=params.ts, savedmodel_dir=params.model, out_tensor=out_tensor,
                                             out_nodatavalue=-10000, out_pixeltype=otbApplication.ImagePixelType_int16)
 
-    # If needed, extracting ROI of the reconstructed image
+    # ROI extraction parameters, shared by all the extracted rasters
+    roi_kwargs = None
     if params.lrx and params.lry and params.ulx and params.uly:
-        processor = pyotb.App('ExtractROI',
-                              {'in': processor, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                               'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                               'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry})
+        roi_kwargs = {'mode': 'extent', 'mode.extent.unit': 'phy',
+                      'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
+                      'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry}
+
+    # If needed, extracting ROI of the reconstructed image
+    if roi_kwargs:
+        processor = pyotb.App('ExtractROI', {'in': processor, **roi_kwargs})
 
     # OTB extended filename that will be used for all writing
     filename_extension = ("&streaming:type=tiled&streaming:sizemode=height&streaming:sizevalue={}&"
-                          "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES".format(params.ts))
+                          "gdal:co:COMPRESS=DEFLATE&gdal:co:PREDICTOR=2&gdal:co:NUM_THREADS=ALL_CPUS&"
+                          "gdal:co:TILED=YES".format(params.ts))
 
     processor.write(out=output_path, filename_extension=filename_extension)
 
-    # Writing the inputs sources of the model
+    # Writing the inputs sources of the model. They are written one after the other: the pipelines share upstream
+    # OTB applications, and an ITK pipeline can't be updated from several threads at once
     if params.write_intermediate:
         for name, source in sources.items():
             if name != 'dem':
+                if isinstance(source, str):  # if needed transform the filepath to pyotb in-memory object
+                    source = pyotb.Input(source)
                 # If needed, extracting ROI of every rasters
-                if params.lrx and params.lry and params.ulx and params.uly:
-                    source = pyotb.App('ExtractROI',
-                                       {'in': source, 'mode': 'extent', 'mode.extent.unit': 'phy',
-                                        'mode.extent.ulx': params.ulx, 'mode.extent.uly': params.uly,
-                                        'mode.extent.lrx': params.lrx, 'mode.extent.lry': params.lry})
-                pyotb.Input(source).write(os.path.join(os.path.dirname(output_path),
-                                                       os.path.basename(output_path).replace('monthly_synthesis',
-                                                                                             name)),
-                                          pixel_type='int32', filename_extension=filename_extension)
+                if roi_kwargs:
+                    source = pyotb.App('ExtractROI', {'in': source, **roi_kwargs})
+                source.write(os.path.join(os.path.dirname(output_path),
+                                          os.path.basename(output_path).replace('monthly_synthesis', name)),
+                             pixel_type='int32', filename_extension=filename_extension)
@@ -23,15 +23,88 @@ DEALINGS IN THE SOFTWARE.
 """Classes for Sentinel products handling"""
 from decloud.core import system
 from decloud.core.system import logging_info
+from decloud.core.raster import nonzero_ratio
 import decloud.preprocessing.constants as constants
 import abc
 import datetime
+import functools
 import os
 import numpy as np
 import otbApplication
 import pyotb
 
 
+# ------------------------------------------------------- Helpers ------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=512)
+def _index_product_files(product_path, ext, _mtime):
+    """
+    Indexes the files of a product by the end of their name (e.g. "_B02_10m.jp2" or "_FRE_B2.tif"). The result is
+    cached, so that the .zip archive (or the directory) is read once when the different products types are tried on
+    the same path
+    :param product_path: product path (.zip or directory)
+    :param ext: end of the filenames to be matched, used only when the product is a directory
+    :param _mtime: modification time of the product. Unused, it is part of the cache key so that a modified product
+                   is indexed again
+    :return: dict of the filepaths, indexed by the part of their name that starts at the second to last "_"
+    """
+    if product_path.lower().endswith(".zip"):
+        files = [system.to_vsizip(product_path, f) for f in system.list_files_in_zip(product_path)]
+    else:
+        files = system.get_files(product_path, ext)
+    index = {}
+    for filepath in files:
+        # the first file is kept when several files share the same end, as the former linear search did
+        index.setdefault("_" + "_".join(os.path.basename(filepath).split("_")[-2:]), filepath)
+    return index
+
+
+def index_product_files(product_path, ext):
+    """
+    Indexes the files of a product (.zip archive or directory) by the end of their name
+    :param product_path: product path (.zip or directory)
+    :param ext: end of the filenames to be matched, used only when the product is a directory
+    :return: dict of the filepaths
+    """
+    is_zip = product_path.lower().endswith(".zip")
+    return _index_product_files(product_path, None if is_zip else ext, os.path.getmtime(product_path))
+
+
+def timestamps_array(products):
+    """
+    Gathers the timestamps of products in a single array, e.g. to sort them or search the closest dates with numpy
+    :param products: iterable of products
+    :return: numpy array of the timestamps, in the order of the products
+    """
+    return np.fromiter((product.get_timestamp() for product in products), dtype=np.float64)
+
+
+def as_pyotb(image):
+    """
+    Transforms a filepath into a pyotb in-memory object, if needed
+    :param image: filepath or pyotb object
+    :return: pyotb object
+    """
+    return pyotb.Input(image) if isinstance(image, str) else image
+
+
+def is_all_nodata(s2_product, roi_kwargs=None):
+    """
+    Checks if a S2 product is all NoData. The array is only held during the check
+    :param s2_product: S2 product
+    :param roi_kwargs: Optional. ExtractROI parameters of the region of interest
+    :return: True if the product (or its region of interest) is all NoData
+    """
+    # we consider the 20m image (because it is smaller than 10m image)
+    s2_20m = s2_product.get_raster_20m()
+    # If needed, extracting ROI
+    if roi_kwargs:
+        s2_20m = pyotb.ExtractROI({'in': s2_20m, **roi_kwargs})
+    # All the bands share the same NoData mask: only the first band is loaded
+    return np.max(np.asarray(as_pyotb(s2_20m)[:, :, 0])) <= 0
+
+
 # -------------------------------------------------------- Base --------------------------------------------------------
 
 
@@ -44,7 +117,7 @@ class ProductBase(abc.ABC):
     def __init__(self, product_path):
         assert isinstance(product_path, str)
         self.product_path = product_path
-        pass
+        self._timestamp = None
 
     @abc.abstractmethod
     def get_date(self):
@@ -61,7 +134,12 @@ class ProductBase(abc.ABC):
         pass
 
     def get_timestamp(self):
-        return self.get_date().timestamp()
+        """
+        :return: the timestamp of the product date (computed once)
+        """
+        if self._timestamp is None:
+            self._timestamp = self.get_date().timestamp()
+        return self._timestamp
 
 
 # ----------------------------------------------------- Sentinel-1 -----------------------------------------------------
@@ -121,6 +199,9 @@ class S1_TILED(S1ProductBase):
         self.date = datetime.datetime.strptime(datestr, '%Y%m%dt%H%M%S')
         logging_info("Date: {}".format(self.date), verbose)
 
+        # Percentage of NoData, computed on the first call of get_nodata_percentage()
+        self._nodata_percentage = None
+
     def get_raster_10m(self):
         return self.bands_10m_file
 
@@ -131,16 +212,21 @@ class S1_TILED(S1ProductBase):
         return 0.0
 
     def get_nodata_percentage(self):
-        nodatas = (pyotb.Input(self.edge_raster) != 0)
-        return np.mean(nodatas)
+        """
+        :return: the percentage of NoData in the edge mask (computed once)
+        """
+        if self._nodata_percentage is None:
+            self._nodata_percentage = nonzero_ratio(self.edge_raster)
+        return self._nodata_percentage
 
     def get_raster_10m_encoding(self):
         return otbApplication.ImagePixelType_uint16
 
 
 class S1_THEIA(S1ProductBase):
-    def __init__(self, product_path):
+    def __init__(self, product_path, verbose=True):
         """product_path can either be the VV or the VH path"""
+        logging_info("Init. S1_THEIA product", verbose)
         super().__init__(product_path)
 
         # From one polarization, deducing the other
@@ -163,26 +249,20 @@ class S1_THEIA(S1ProductBase):
         datestr = product_name.split('_')[5].split('t')[0]
         self.date = datetime.datetime.strptime(datestr, '%Y%m%d')
 
+        # normalization pipeline of the 10m bands, created on the first call of get_raster_10m()
+        self._raster_10m_app = None
+
     def get_raster_10m(self):
-        def _bm(input_fn):
-            """ BandMath for SAR normalization """
-            bm = otbApplication.Registry.CreateApplication("BandMath")
-            bm.SetParameterStringList("il", [input_fn])
-            bm.SetParameterString("exp", constants.S1_NORMALIZATION_BM_EXPR)
-            bm.SetParameterOutputImagePixelType("out", otbApplication.ImagePixelType_uint16)
-            bm.Execute()
-            return bm
-
-        bm_vv = _bm(self.vv_file)
-        bm_vh = _bm(self.vh_file)
-
-        conc = otbApplication.Registry.CreateApplication("ConcatenateImages")
-        conc.ConnectImage("il", bm_vv, 'out')
-        conc.ConnectImage("il", bm_vh, 'out')
-        # TODO: vérifier si PixelType est utile ?
-        conc.SetParameterOutputImagePixelType("out", otbApplication.ImagePixelType_uint16)
-
-        return conc
+        """
+        :return: the normalized VV and VH stacking pipeline (created once)
+        """
+        if self._raster_10m_app is None:
+            # Both channels are normalized and stacked in a single pass over the VV and VH images
+            bmx = constants.s1_normalize_vvvh(self.vv_file, self.vh_file)
+            bmx.Execute()
+            self._raster_10m_app = bmx
+
+        return self._raster_10m_app
 
     def get_date(self):
         return self.date
@@ -206,6 +286,7 @@ class S2ProductBase(ProductBase):
     @abc.abstractmethod
     def __init__(self, product_path):
         super().__init__(product_path)
+        self._all_bands = None
 
     @abc.abstractmethod
     def get_raster_10m(self):
@@ -226,12 +307,13 @@ class S2ProductBase(ProductBase):
     def get_raster_all_bands(self):
         """
         Stack the 10m + 20m bands in a raster with 10m resolution
-        :return: an App object
+        :return: an App object (created once)
         """
-        raster_20m_resampled = pyotb.Superimpose(inr=self.get_raster_10m(), inm=self.get_raster_20m(),
-                                                 interpolator='nn')
-        stack = pyotb.ConcatenateImages([self.get_raster_10m(), raster_20m_resampled])
-        return stack
+        if self._all_bands is None:
+            raster_10m = self.get_raster_10m()
+            raster_20m_resampled = pyotb.Superimpose(inr=raster_10m, inm=self.get_raster_20m(), interpolator='nn')
+            self._all_bands = pyotb.ConcatenateImages([raster_10m, raster_20m_resampled])
+        return self._all_bands
 
     @abc.abstractmethod
     def get_raster_10m_encoding(self):
@@ -251,31 +333,27 @@ class S2_ESA(S2ProductBase):
             is_zip = product_path.lower().endswith(".zip")
             if is_zip:
                 logging_info("Input type is a .zip archive", verbose)
-                files = system.list_files_in_zip(product_path)
-                files = [system.to_vsizip(product_path, f) for f in files]
             else:
                 logging_info("Input type is a directory", verbose)
-                files = system.get_files(product_path, '.jp2')
-            return files
+            return index_product_files(product_path, '.jp2')
 
-        def _filter_files(files, endswith):
-            filelist = [f for f in files if f.endswith(endswith)]
-            if len(filelist) == 0:
+        def _find_file(files, endswith):
+            if endswith not in files:
                 raise Exception("{} not a S2_ESA product : {} is missing".format(product_path, endswith))
-            return filelist
+            return files[endswith]
 
         # Rasters
         files = _get_files()
-        self.band2_file = _filter_files(files, "_B02_10m.jp2")[0]
-        self.band3_file = _filter_files(files, "_B03_10m.jp2")[0]
-        self.band4_file = _filter_files(files, "_B04_10m.jp2")[0]
-        self.band8_file = _filter_files(files, "_B08_10m.jp2")[0]
-        self.band5_file = _filter_files(files, "_B05_20m.jp2")[0]
-        self.band6_file = _filter_files(files, "_B06_20m.jp2")[0]
-        self.band7_file = _filter_files(files, "_B07_20m.jp2")[0]
-        self.band8a_file = _filter_files(files, "_B8A_20m.jp2")[0]
-        self.band11_file = _filter_files(files, "_B11_20m.jp2")[0]
-        self.band12_file = _filter_files(files, "_B12_20m.jp2")[0]
+        self.band2_file = _find_file(files, "_B02_10m.jp2")
+        self.band3_file = _find_file(files, "_B03_10m.jp2")
+        self.band4_file = _find_file(files, "_B04_10m.jp2")
+        self.band8_file = _find_file(files, "_B08_10m.jp2")
+        self.band5_file = _find_file(files, "_B05_20m.jp2")
+        self.band6_file = _find_file(files, "_B06_20m.jp2")
+        self.band7_file = _find_file(files, "_B07_20m.jp2")
+        self.band8a_file = _find_file(files, "_B8A_20m.jp2")
+        self.band11_file = _find_file(files, "_B11_20m.jp2")
+        self.band12_file = _find_file(files, "_B12_20m.jp2")
 
         # Date
         onefile = self.band2_file
@@ -331,33 +409,29 @@ class S2_THEIA(S2ProductBase):
             is_zip = product_path.lower().endswith(".zip")
             if is_zip:
                 logging_info("Input type is a .zip archive", verbose)
-                files = system.list_files_in_zip(product_path)
-                files = [system.to_vsizip(product_path, f) for f in files]
             else:
                 logging_info("Input type is a directory", verbose)
-                files = system.get_files(product_path, '.tif')
-            return files
+            return index_product_files(product_path, '.tif')
 
-        def _filter_files(files, endswith):
-            filelist = [f for f in files if f.endswith(endswith)]
-            if len(filelist) == 0:
+        def _find_file(files, endswith):
+            if endswith not in files:
                 raise Exception("{} not a S2_THEIA product : {} is missing".format(product_path, endswith))
-            return filelist
+            return files[endswith]
 
         # Rasters
         files = _get_files()
-        self.band2_file = _filter_files(files, "_FRE_B2.tif")[0]
-        self.band3_file = _filter_files(files, "_FRE_B3.tif")[0]
-        self.band4_file = _filter_files(files, "_FRE_B4.tif")[0]
-        self.band8_file = _filter_files(files, "_FRE_B8.tif")[0]
-        self.band5_file = _filter_files(files, "_FRE_B5.tif")[0]
-        self.band6_file = _filter_files(files, "_FRE_B6.tif")[0]
-        self.band7_file = _filter_files(files, "_FRE_B7.tif")[0]
-        self.band8a_file = _filter_files(files, "_FRE_B8A.tif")[0]
-        self.band11_file = _filter_files(files, "_FRE_B11.tif")[0]
-        self.band12_file = _filter_files(files, "_FRE_B12.tif")[0]
-        self.cld_msk_file = _filter_files(files, "_CLM_R1.tif")[0]
-        self.edg_msk_file = _filter_files(files, "_EDG_R1.tif")[0]
+        self.band2_file = _find_file(files, "_FRE_B2.tif")
+        self.band3_file = _find_file(files, "_FRE_B3.tif")
+        self.band4_file = _find_file(files, "_FRE_B4.tif")
+        self.band8_file = _find_file(files, "_FRE_B8.tif")
+        self.band5_file = _find_file(files, "_FRE_B5.tif")
+        self.band6_file = _find_file(files, "_FRE_B6.tif")
+        self.band7_file = _find_file(files, "_FRE_B7.tif")
+        self.band8a_file = _find_file(files, "_FRE_B8A.tif")
+        self.band11_file = _find_file(files, "_FRE_B11.tif")
+        self.band12_file = _find_file(files, "_FRE_B12.tif")
+        self.cld_msk_file = _find_file(files, "_CLM_R1.tif")
+        self.edg_msk_file = _find_file(files, "_EDG_R1.tif")
 
         # Date
         onefile = self.band2_file
@@ -404,8 +478,11 @@ class S2_TILED(S2ProductBase):
         logging_info("Init. S2_TILED product", verbose)
         super().__init__(product_path)
 
+        # The product directory is walked once, then the files are dispatched by their ending
+        all_files = system.get_files(product_path)
+
         def _get_files(endswith, number_expected):
-            files = system.get_files(product_path, endswith)
+            files = [f for f in all_files if f.lower().endswith(endswith.lower())]
             if len(files) != number_expected:
                 raise Exception("Not a S2_TILED product (expected {} files ending with {})".format(number_expected,
                                                                                                    endswith))
@@ -423,6 +500,10 @@ class S2_TILED(S2ProductBase):
         datestr = onefile.split("_")[1]
         self.date = datetime.datetime.strptime(datestr, '%Y%m%d-%H%M%S-%f')
 
+        # Percentages of NoData and clouds, computed on the first call of their getter
+        self._nodata_percentage = None
+        self._cloud_percentage = None
+
     def get_raster_10m(self):
         # TODO: Use the statistics + ExtractROI to crop the output image
         return self.bands_10m_file
@@ -438,12 +519,20 @@ class S2_TILED(S2ProductBase):
         return otbApplication.ImagePixelType_int16
 
     def get_nodata_percentage(self):
-        nodatas = (pyotb.Input(self.edg_msk_file) != 0)
-        return np.mean(nodatas)
+        """
+        :return: the percentage of NoData in the edge mask (computed once)
+        """
+        if self._nodata_percentage is None:
+            self._nodata_percentage = nonzero_ratio(self.edg_msk_file)
+        return self._nodata_percentage
 
     def get_cloud_percentage(self):
-        clouds = (pyotb.Input(self.cld_msk_file) != 0)
-        return np.mean(clouds)
+        """
+        :return: the percentage of clouds in the cloud mask (computed once)
+        """
+        if self._cloud_percentage is None:
+            self._cloud_percentage = nonzero_ratio(self.cld_msk_file)
+        return self._cloud_percentage
 
     def get_nodatavalue(self):
         return -10000
@@ -452,6 +541,23 @@ class S2_TILED(S2ProductBase):
 # ----------------------------------------------------- Factory --------------------------------------------------------
 
 class Factory:
+    # Extensions of the files that can be products. The S2 products can also be directories
+    ACCEPTED_EXTENSIONS = {"s1": (".tif",), "s2": (".zip",)}
+
+    @staticmethod
+    def list_candidates(directory, product_type):
+        """
+        Lists the entries of a directory that can be products, so that no product is created from other files
+        :param directory: directory
+        :param product_type: "s1" or "s2"
+        :return: list of paths
+        """
+        assert product_type in Factory.ACCEPTED_EXTENSIONS
+        extensions = Factory.ACCEPTED_EXTENSIONS[product_type]
+        with os.scandir(directory) as entries:
+            return [entry.path for entry in entries
+                    if entry.name.lower().endswith(extensions) or (product_type == "s2" and entry.is_dir())]
+
     @staticmethod
     def create(product_path, product_type, verbose=True):
         """
@@ -473,14 +579,25 @@ class Factory:
                     logging_info("Product is not of type {} (Exception: {})".format(product_type, exp), verbose)
                     pass
 
+        # The most likely products types are tried first, according to the file name, so that a product is
+        # usually created without any failing attempt
+        name = system.basename(product_path)
         if product_type == "s1":
-            _try_load(S1_TILED)
-            _try_load(S1_THEIA)
+            if name.endswith("_{}.tif".format(constants.SUFFIX_S1)):
+                product_classes = [S1_TILED, S1_THEIA]
+            else:
+                product_classes = [S1_THEIA, S1_TILED]
         elif product_type == "s2":
-            _try_load(S2_TILED)
-            _try_load(S2_THEIA)
-            _try_load(S2_ESA)
+            if "_MSIL2A_" in name:
+                product_classes = [S2_ESA, S2_TILED, S2_THEIA]
+            elif name.lower().endswith(".zip"):
+                # S2_TILED products are always directories
+                product_classes = [S2_THEIA, S2_ESA]
+            else:
+                product_classes = [S2_TILED, S2_THEIA, S2_ESA]
         else:
             raise Exception("product_type must be either \"s1\" or \"s2\" (value: {})".format(product_type))
+        for product_class in product_classes:
+            _try_load(product_class)
 
         return ret
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+from unittest import mock
+import decloud.preprocessing.constants as constants
+
+
+class CompressionOptionsTest(unittest.TestCase):
+
+    def compression_options(self, env_value=None, has_zstd=True):
+        """
+        Returns the compression options, with the DECLOUD_COMPRESS environment variable set to env_value (unset if
+        None), and a GDAL with or without ZSTD
+        """
+        env = {key: value for key, value in os.environ.items() if key != "DECLOUD_COMPRESS"}
+        if env_value is not None:
+            env["DECLOUD_COMPRESS"] = env_value
+        with mock.patch.dict(os.environ, env, clear=True), \
+                mock.patch.object(constants, "gdal_has_zstd", return_value=has_zstd) as gdal_has_zstd:
+            options = constants.compression_options()
+        # GDAL is probed only when the compression is not forced
+        self.assertEqual(gdal_has_zstd.called, env_value is None)
+        return options
+
+    def test_compression_options_default(self):
+        self.assertEqual(self.compression_options(), constants.COMPRESSION_OPTIONS["zstd"])
+        # Fallback when GDAL is built without ZSTD
+        options = self.compression_options(has_zstd=False)
+        self.assertEqual(options, constants.COMPRESSION_OPTIONS["deflate"])
+        self.assertIn("COMPRESS=DEFLATE", options)
+        self.assertIn("PREDICTOR=2", options)
+
+    def test_compression_options_env(self):
+        self.assertEqual(self.compression_options("deflate"), constants.COMPRESSION_OPTIONS["deflate"])
+        self.assertEqual(self.compression_options("ZSTD", has_zstd=False), constants.COMPRESSION_OPTIONS["zstd"])
+        with self.assertRaises(ValueError):
+            self.compression_options("lzw")
+
+    def test_gdal_has_zstd(self):
+        self.assertIsInstance(constants.gdal_has_zstd(), bool)
+
+
+if __name__ == '__main__':
+    unittest.main()
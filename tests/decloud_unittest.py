@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import subprocess
 import unittest
 import filecmp
+import numpy as np
 from osgeo import gdal
-import otbApplication as otb
 from abc import ABC
-from decloud.core.system import get_env_var, basename
+from decloud.core.system import get_env_var
 
 
 class DecloudTest(ABC, unittest.TestCase):
 
     DECLOUD_DATA_DIR = get_env_var("DECLOUD_DATA_DIR")
+    # Directory of the tests outputs. Can be set to a RAM-backed filesystem (e.g. /dev/shm) on runners with slow disks
+    DECLOUD_TMP_DIR = os.environ.get("DECLOUD_TMP_DIR", "/tmp")
 
     def get_path(self, path):
         pth = os.path.join(self.DECLOUD_DATA_DIR, path)
@@ -20,38 +21,37 @@ class DecloudTest(ABC, unittest.TestCase):
             raise FileNotFoundError(f"Directory {pth} not found!")
         return pth
 
-    def compare_images(self, image, reference, mae_threshold=0.01):
+    def get_tmp_path(self, filename):
+        return os.path.join(self.DECLOUD_TMP_DIR, filename)
 
-        nbchannels_reconstruct = gdal.Open(image).RasterCount
-        nbchannels_baseline = gdal.Open(reference).RasterCount
+    def compare_images(self, image, reference, mae_threshold=0.01, block_rows=512):
 
-        self.assertTrue(nbchannels_reconstruct == nbchannels_baseline)
+        image_ds = gdal.Open(image)
+        reference_ds = gdal.Open(reference)
 
-        for i in range(1, 1+nbchannels_baseline):
-            comp = otb.Registry.CreateApplication('CompareImages')
-            comp.SetParameterString('ref.in', reference)
-            comp.SetParameterInt('ref.channel', i)
-            comp.SetParameterString('meas.in', image)
-            comp.SetParameterInt('meas.channel', i)
-            comp.Execute()
-            mae = comp.GetParameterFloat('mae')
+        self.assertTrue(image_ds.RasterCount == reference_ds.RasterCount)
 
-            self.assertTrue(mae < mae_threshold)
+        # Mean absolute error of every channel, computed in a single pass over both images, by blocks of rows
+        width, height = reference_ds.RasterXSize, reference_ds.RasterYSize
+        abs_errors = np.zeros(reference_ds.RasterCount)
+        for y in range(0, height, block_rows):
+            rows = min(block_rows, height - y)
+            ref = reference_ds.ReadAsArray(0, y, width, rows).astype(np.float64)
+            meas = image_ds.ReadAsArray(0, y, width, rows).astype(np.float64)
+            abs_errors += np.abs(ref - meas).reshape(reference_ds.RasterCount, -1).sum(axis=1)
+        maes = abs_errors / (width * height)
+
+        self.assertTrue(np.all(maes < mae_threshold))
 
     def compare_file(self, file, reference):
         self.assertTrue(filecmp.cmp(file, reference))
 
     def compare_raster_metadata(self, image, reference):
-        baseline_gdalinfo_path = '/tmp/baseline_{}_gdalinfo'.format(basename(reference))
-        subprocess.call('gdalinfo {} | grep --invert-match -e "Files:" -e "METADATATYPE" -e "OTB_VERSION" '
-                      '-e "NoData Value" > {}'.format(reference, baseline_gdalinfo_path), shell=True)
-
-        image_gdalinfo_path = '/tmp/image_{}_gdalinfo'.format(basename(image))
-        subprocess.call('gdalinfo {} | grep --invert-match -e "Files:" -e "METADATATYPE" -e "OTB_VERSION" '
-                        '-e "NoData Value" > {}'.format(image, image_gdalinfo_path), shell=True)
-
-        with open(baseline_gdalinfo_path) as f:
-            baseline_gdalinfo = f.read()
-        with open(image_gdalinfo_path) as f:
-            image_gdalinfo_path = f.read()
-        self.assertEqual(baseline_gdalinfo, image_gdalinfo_path)
+        ignored = ("Files:", "METADATATYPE", "OTB_VERSION", "NoData Value")
+
+        def _filtered_info(path):
+            """gdalinfo output of the raster, without the lines that can differ between two runs"""
+            info = gdal.Info(gdal.Open(path), format='text')
+            return "\n".join(line for line in info.splitlines() if not any(key in line for key in ignored))
+
+        self.assertEqual(_filtered_info(reference), _filtered_info(image))
@@ -7,18 +7,47 @@ import pyotb
 import unittest
 from decloud.production import crga_processor
 from decloud.production.inference import inference
+import decloud.preprocessing.constants as constants
 from .decloud_unittest import DecloudTest
 import datetime
 
 
 def get_timestamp(yyyymmdd):
-    dt = datetime.datetime.strptime(yyyymmdd, '%Y%m%d')
-    ts = dt.replace(tzinfo=datetime.timezone.utc).timestamp()
-    return str(ts)
+    dt = datetime.datetime(int(yyyymmdd[:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8]), tzinfo=datetime.timezone.utc)
+    return str(dt.timestamp())
+
+
+# Prepared images used by the tests
+S1_PREPARE_DIR = 'baseline/PREPARE/S1_PREPARE/T31TEJ'
+S2_PREPARE_DIR = 'baseline/PREPARE/S2_PREPARE/T31TEJ'
+DEM = 'baseline/PREPARE/DEM_PREPARE/T31TEJ.tif'
+S1_TM1 = ['s1b_31TEJ_vvvh_DES_110_20200929t060008_from-10to3dB.tif',
+          's1a_31TEJ_vvvh_DES_037_20200930txxxxxx_from-10to3dB.tif',
+          's1b_31TEJ_vvvh_DES_139_20201001txxxxxx_from-10to3dB.tif']
+S2_TM1 = ['SENTINEL2B_20200926-103901-393_L2A_T31TEJ_C_V2-2',
+          'SENTINEL2B_20200929-104857-489_L2A_T31TEJ_C_V2-2']
+S1_T = ['s1b_31TEJ_vvvh_DES_110_20201011t060008_from-10to3dB.tif',
+        's1b_31TEJ_vvvh_DES_139_20201013txxxxxx_from-10to3dB.tif',
+        's1a_31TEJ_vvvh_DES_037_20201012txxxxxx_from-10to3dB.tif']
+S2_T = 'SENTINEL2B_20201012-105848-497_L2A_T31TEJ_C_V2-2'
+S1_TP1 = ['s1b_31TEJ_vvvh_DES_139_20201025txxxxxx_from-10to3dB.tif',
+          's1a_31TEJ_vvvh_DES_037_20201024txxxxxx_from-10to3dB.tif',
+          's1b_31TEJ_vvvh_DES_110_20201023t060008_from-10to3dB.tif']
+S2_TP1 = ['SENTINEL2B_20201026-103901-924_L2A_T31TEJ_C_V2-2',
+          'SENTINEL2A_20201024-104859-766_L2A_T31TEJ_C_V2-2']
 
 
 class InferenceTest(DecloudTest):
 
+    def s1_paths(self, names):
+        return [self.get_path(f'{S1_PREPARE_DIR}/{name}') for name in names]
+
+    def s2_path(self, name, fre_10m=False):
+        """Path of the S2 product directory, or of its 10m bands image if fre_10m is True"""
+        if fre_10m:
+            return self.get_path(f'{S2_PREPARE_DIR}/{name}/{name}_FRE_10m.tif')
+        return self.get_path(f'{S2_PREPARE_DIR}/{name}')
+
     def test_inference_with_mosaic(self):
         # Logger
         system.basic_logging_init()
@@ -30,31 +59,12 @@ class InferenceTest(DecloudTest):
         model_path = self.get_path("models/crga_os2david_occitanie_pretrained")
 
         # Input sources
-        s1_tm1 = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20200929t060008_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20200930txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201001txxxxxx_from-10to3dB.tif')]
-        s2_tm1 = [
-            self.get_path(
-                'baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20200926-103901-393_L2A_T31TEJ_C_V2-2/SENTINEL2B_20200926-103901-393_L2A_T31TEJ_C_V2-2_FRE_10m.tif'),
-            self.get_path(
-                'baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20200929-104857-489_L2A_T31TEJ_C_V2-2/SENTINEL2B_20200929-104857-489_L2A_T31TEJ_C_V2-2_FRE_10m.tif')]
-        s1_t = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20201011t060008_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201013txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20201012txxxxxx_from-10to3dB.tif')]
-        s2_t = [
-            self.get_path(
-                'baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20201012-105848-497_L2A_T31TEJ_C_V2-2/SENTINEL2B_20201012-105848-497_L2A_T31TEJ_C_V2-2_FRE_10m.tif')]
-        s1_tp1 = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201025txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20201024txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20201023t060008_from-10to3dB.tif')]
-        s2_tp1 = [
-            self.get_path(
-                'baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20201026-103901-924_L2A_T31TEJ_C_V2-2/SENTINEL2B_20201026-103901-924_L2A_T31TEJ_C_V2-2_FRE_10m.tif'),
-            self.get_path(
-                'baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2A_20201024-104859-766_L2A_T31TEJ_C_V2-2/SENTINEL2A_20201024-104859-766_L2A_T31TEJ_C_V2-2_FRE_10m.tif')]
+        s1_tm1 = self.s1_paths(S1_TM1)
+        s2_tm1 = [self.s2_path(name, fre_10m=True) for name in S2_TM1]
+        s1_t = self.s1_paths(S1_T)
+        s2_t = [self.s2_path(S2_T, fre_10m=True)]
+        s1_tp1 = self.s1_paths(S1_TP1)
+        s2_tp1 = [self.s2_path(name, fre_10m=True) for name in S2_TP1]
 
         # Input sources
         sources = {'s1_tm1': pyotb.Mosaic(il=s1_tm1, nodata=0),
@@ -63,22 +73,22 @@ class InferenceTest(DecloudTest):
                    's2_tp1': pyotb.Mosaic(il=s2_tp1, nodata=-10000),
                    's1_t': pyotb.Mosaic(il=s1_t, nodata=0),
                    's2_t': pyotb.Mosaic(il=s2_t, nodata=-10000),
-                   'dem': self.get_path('baseline/PREPARE/DEM_PREPARE/T31TEJ.tif')}
+                   'dem': self.get_path(DEM)}
 
         # Sources scales
         sources_scales = {"dem": 2}
 
         # Inference
         out_tensor = "s2_estim"
-        outpath = '/tmp/reconstructed_w_mosaic.tif'
+        outpath = self.get_tmp_path('reconstructed_w_mosaic.tif')
         processor = inference(sources=sources, sources_scales=sources_scales, pad=64,
                               ts=256, savedmodel_dir=model_path, out_tensor=out_tensor, out_nodatavalue=-10000,
                               out_pixeltype=otbApplication.ImagePixelType_int16,
                               nodatavalues={"s1_tm1": 0, "s2_tm1": -10000, "s1_tp1": 0,
                                             "s2_tp1": -10000, "s1_t": 0, "s2_t": -10000})
         processor.write(out=outpath, filename_extension="&streaming:type=tiled&streaming:sizemode=height&"
-                                                        "streaming:sizevalue=256&"
-                                                        "gdal:co:COMPRESS=DEFLATE&gdal:co:TILED=YES")
+                                                        "streaming:sizevalue=256&gdal:co:TILED=YES{}".format(
+                                                            constants.compression_options()))
 
         # Just a dummy test
         self.assertTrue(system.file_exists(outpath))
@@ -96,31 +106,18 @@ class InferenceTest(DecloudTest):
         model_path = self.get_path("models/crga_os2david_occitanie_pretrained")
 
         # Input sources
-        s1_tm1 = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20200929t060008_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20200930txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201001txxxxxx_from-10to3dB.tif')]
-        s2_tm1 = [
-            self.get_path('baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20200926-103901-393_L2A_T31TEJ_C_V2-2/'),
-            self.get_path('baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20200929-104857-489_L2A_T31TEJ_C_V2-2/')]
-        s1_t = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20201011t060008_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201013txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20201012txxxxxx_from-10to3dB.tif')]
-        s2_t = self.get_path('baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20201012-105848-497_L2A_T31TEJ_C_V2-2')
-        s1_tp1 = [
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_139_20201025txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1a_31TEJ_vvvh_DES_037_20201024txxxxxx_from-10to3dB.tif'),
-            self.get_path('baseline/PREPARE/S1_PREPARE/T31TEJ/s1b_31TEJ_vvvh_DES_110_20201023t060008_from-10to3dB.tif')]
-        s2_tp1 = [
-            self.get_path('baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2B_20201026-103901-924_L2A_T31TEJ_C_V2-2'),
-            self.get_path('baseline/PREPARE/S2_PREPARE/T31TEJ/SENTINEL2A_20201024-104859-766_L2A_T31TEJ_C_V2-2/')]
-
-        outpath = '/tmp/reconstructed_w_preprocessor.tif'
+        s1_tm1 = self.s1_paths(S1_TM1)
+        s2_tm1 = [self.s2_path(name) for name in S2_TM1]
+        s1_t = self.s1_paths(S1_T)
+        s2_t = self.s2_path(S2_T)
+        s1_tp1 = self.s1_paths(S1_TP1)
+        s2_tp1 = [self.s2_path(name) for name in S2_TP1]
+
+        outpath = self.get_tmp_path('reconstructed_w_preprocessor.tif')
         crga_processor.crga_processor(il_s1before=s1_tm1, il_s2before=s2_tm1,
                                       il_s1=s1_t, in_s2=s2_t,
                                       il_s1after=s1_tp1, il_s2after=s2_tp1,
-                                      dem=self.get_path('baseline/PREPARE/DEM_PREPARE/T31TEJ.tif'),
+                                      dem=self.get_path(DEM),
                                       output=outpath, maxgap=48, savedmodel=model_path)
 
         # Just a dummy test
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import decloud.preprocessing.constants as constants
+from decloud.production import products
+from decloud.production.products import Factory
+
+PRODUCTS_CLASSES = ["S1_TILED", "S1_THEIA", "S2_ESA", "S2_THEIA", "S2_TILED"]
+
+
+class ListCandidatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix="products_")
+        for filename in ["s1_vvvh.tif", "S1_VVVH.TIF", "SENTINEL2B_20180619-103559-594_L2A_T31TEJ_D_V1-8.zip",
+                         "products.txt", "s1_vvvh.tif.aux.xml"]:
+            with open(os.path.join(self.tmp_dir.name, filename), "w") as text_file:
+                text_file.write("")
+        os.mkdir(os.path.join(self.tmp_dir.name, "SENTINEL2A_20191231-104524-735_L2A_T31TEJ_C_V2-2"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_names(self, product_type):
+        return sorted(os.path.basename(path) for path in Factory.list_candidates(self.tmp_dir.name, product_type))
+
+    def test_list_candidates_s1(self):
+        # Only the .tif files (whatever the case of their extension), and no directory
+        self.assertEqual(self.get_names("s1"), ["S1_VVVH.TIF", "s1_vvvh.tif"])
+
+    def test_list_candidates_s2(self):
+        # The .zip files and the directories
+        self.assertEqual(self.get_names("s2"), ["SENTINEL2A_20191231-104524-735_L2A_T31TEJ_C_V2-2",
+                                                "SENTINEL2B_20180619-103559-594_L2A_T31TEJ_D_V1-8.zip"])
+
+
+class FactoryCreateTest(unittest.TestCase):
+
+    @staticmethod
+    def create(product_path, product_type, valid_class=None):
+        """
+        Creates a product with mocked products classes. Only valid_class can be instantiated.
+        :return: the created product (i.e. the name of its class, or None) and the names of the classes tried in order
+        """
+        tried = []
+
+        def _mock_class(name):
+            def _create(product_path, verbose):
+                tried.append(name)
+                if name != valid_class:
+                    raise Exception("Not a {} product".format(name))
+                return name
+            return mock.Mock(side_effect=_create)
+
+        with mock.patch.multiple(products, **{name: _mock_class(name) for name in PRODUCTS_CLASSES}):
+            product = Factory.create(product_path, product_type, verbose=False)
+        return product, tried
+
+    def test_create_s2_esa(self):
+        path = "/data/S2A_MSIL2A_20200101T103431_N0213_R108_T31TEJ_20200102T121308.zip"
+        self.assertEqual(self.create(path, "s2", "S2_ESA"), ("S2_ESA", ["S2_ESA"]))
+
+    def test_create_s2_theia(self):
+        path = "/data/SENTINEL2B_20180619-103559-594_L2A_T31TEJ_D_V1-8.zip"
+        self.assertEqual(self.create(path, "s2", "S2_THEIA"), ("S2_THEIA", ["S2_THEIA"]))
+        # The S2_TILED products are directories, hence they are never tried on a .zip file
+        self.assertEqual(self.create(path, "s2"), (None, ["S2_THEIA", "S2_ESA"]))
+
+    def test_create_s2_directory(self):
+        path = "/data/T31TEJ/SENTINEL2A_20191231-104524-735_L2A_T31TEJ_C_V2-2"
+        self.assertEqual(self.create(path, "s2", "S2_TILED"), ("S2_TILED", ["S2_TILED"]))
+        # The other products types are still tried when the most likely one fails
+        self.assertEqual(self.create(path, "s2", "S2_THEIA"), ("S2_THEIA", ["S2_TILED", "S2_THEIA"]))
+
+    def test_create_s1(self):
+        tiled_path = "/data/s1a_31TEJ_vvvh_DES_110_20200101txxxxxx_{}.tif".format(constants.SUFFIX_S1)
+        self.assertEqual(self.create(tiled_path, "s1", "S1_TILED"), ("S1_TILED", ["S1_TILED"]))
+        self.assertEqual(self.create(tiled_path, "s1", "S1_THEIA"), ("S1_THEIA", ["S1_TILED", "S1_THEIA"]))
+        theia_path = "/data/s1a_31TEJ_vvvh_DES_110_20200101txxxxxx.tif"
+        self.assertEqual(self.create(theia_path, "s1", "S1_THEIA"), ("S1_THEIA", ["S1_THEIA"]))
+        self.assertEqual(self.create(theia_path, "s1"), (None, ["S1_THEIA", "S1_TILED"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
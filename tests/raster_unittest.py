@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from osgeo import gdal
+from decloud.core import raster
+
+RASTER_FN = "/vsimem/raster_unittest.tif"
+
+
+class NonzeroRatioTest(unittest.TestCase):
+
+    def setUp(self):
+        # 7 rows x 5 columns, with 7 non-zero pixels in the first band. The second band is not counted
+        first_band = np.zeros((7, 5), dtype=np.uint8)
+        first_band[0, 0] = 1
+        first_band[3, :] = 2
+        first_band[6, 4] = 255
+        gdal_ds = gdal.GetDriverByName("GTiff").Create(RASTER_FN, 5, 7, 2, gdal.GDT_Byte)
+        gdal_ds.GetRasterBand(1).WriteArray(first_band)
+        gdal_ds.GetRasterBand(2).WriteArray(np.ones((7, 5), dtype=np.uint8))
+        gdal_ds = None
+
+    def tearDown(self):
+        gdal.Unlink(RASTER_FN)
+
+    def test_nonzero_ratio(self):
+        # The result does not depend on the blocks of rows, including a last partial block
+        for block_rows in [1, 3, 7, 1024]:
+            self.assertAlmostEqual(raster.nonzero_ratio(RASTER_FN, block_rows=block_rows), 7 / 35)
+
+    def test_nonzero_ratio_all_zeros(self):
+        gdal_ds = gdal.Open(RASTER_FN, gdal.GA_Update)
+        gdal_ds.GetRasterBand(1).Fill(0)
+        gdal_ds = None
+        self.assertEqual(raster.nonzero_ratio(RASTER_FN, block_rows=2), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
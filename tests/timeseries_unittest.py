@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+import numpy as np
+from decloud.production.crga_timeseries_processor import get_nclosest
+from decloud.production.meraner_timeseries_processor import date_from_filename
+
+# Candidate products, sorted by timestamp. "b" and "c", then "e" and "f", have the same timestamp
+PATHS = np.array(["a", "b", "c", "d", "e", "f", "g"])
+TIMESTAMPS = np.array([1., 2., 2., 4., 5., 5., 7.])
+
+
+class GetNClosestTest(unittest.TestCase):
+
+    def test_get_nclosest_before(self):
+        # Closest first, and the products with the same timestamp as the S2 product are not "before"
+        self.assertEqual(get_nclosest(2, 5., PATHS, TIMESTAMPS, 'before'), ["d", "c"])
+        # Products with the same timestamp are selected in time order, i.e. in the order of the sorted candidates
+        self.assertEqual(get_nclosest(3, 4., PATHS, TIMESTAMPS, 'before'), ["c", "b", "a"])
+
+    def test_get_nclosest_after(self):
+        # Closest first, and the products with the same timestamp as the S2 product are not "after"
+        self.assertEqual(get_nclosest(3, 2., PATHS, TIMESTAMPS, 'after'), ["d", "e", "f"])
+        self.assertEqual(get_nclosest(2, 4., PATHS, TIMESTAMPS, 'after'), ["e", "f"])
+
+    def test_get_nclosest_any(self):
+        # The products with the same timestamp as the S2 product are the closest ones
+        self.assertEqual(get_nclosest(2, 5., PATHS, TIMESTAMPS), ["e", "f"])
+        self.assertEqual(get_nclosest(3, 4., PATHS, TIMESTAMPS), ["d", "e", "f"])
+        # Same time gap before and after: the earliest product comes first
+        paths, timestamps = np.array(["a", "b", "c", "d"]), np.array([1., 2., 4., 5.])
+        self.assertEqual(get_nclosest(1, 3., paths, timestamps), ["b"])
+        self.assertEqual(get_nclosest(2, 3., paths, timestamps), ["b", "c"])
+
+    def test_get_nclosest_more_than_candidates(self):
+        self.assertEqual(get_nclosest(5, 2., PATHS, TIMESTAMPS, 'before'), ["a"])
+        self.assertEqual(get_nclosest(5, 5., PATHS, TIMESTAMPS, 'after'), ["g"])
+        self.assertEqual(get_nclosest(10, 3., PATHS[[0, 1, 3]], TIMESTAMPS[[0, 1, 3]]), ["b", "d", "a"])
+
+    def test_get_nclosest_empty(self):
+        # No product before the first one, nor after the last one
+        self.assertEqual(get_nclosest(2, 1., PATHS, TIMESTAMPS, 'before'), [])
+        self.assertEqual(get_nclosest(2, 0., PATHS, TIMESTAMPS, 'before'), [])
+        self.assertEqual(get_nclosest(2, 7., PATHS, TIMESTAMPS, 'after'), [])
+        self.assertEqual(get_nclosest(2, 8., PATHS, TIMESTAMPS, 'after'), [])
+        # No candidate at all
+        for period in ['before', 'after', None]:
+            self.assertEqual(get_nclosest(2, 3., np.array([]), np.array([]), period), [])
+
+
+class DateFromFilenameTest(unittest.TestCase):
+
+    def test_date_from_filename_theia(self):
+        self.assertEqual(date_from_filename("/data/SENTINEL2B_20180619-103559-594_L2A_T31TEJ_D_V1-8.zip"),
+                         datetime.date(2018, 6, 19))
+        # Unzipped product directory
+        self.assertEqual(date_from_filename("/data/T31TEJ/SENTINEL2A_20191231-104524-735_L2A_T31TEJ_C_V2-2"),
+                         datetime.date(2019, 12, 31))
+
+    def test_date_from_filename_esa(self):
+        # The acquisition date comes first, before the production date. Trailing separators are ignored
+        self.assertEqual(date_from_filename("/data/S2A_MSIL2A_20200101T103431_N0213_R108_T31TEJ_20200102T121308.SAFE/"),
+                         datetime.date(2020, 1, 1))
+
+    def test_date_from_filename_none(self):
+        # The date of a parent directory is not used
+        self.assertIsNone(date_from_filename("/data/20200101/my_product.zip"))
+        # Invalid date
+        self.assertIsNone(date_from_filename("/data/SENTINEL2B_20181399-103559-594_L2A_T31TEJ_D_V1-8.zip"))
+
+
+if __name__ == '__main__':
+    unittest.main()